@@ -10,7 +10,6 @@ app_config["PORT"] = 8082
 app_config["GRAPH_PATH"] = "./graphs/"
 app_config["RECORDS_PATH"] = "./records/"
 app_config["STATIC_PATH"] = "./static/"
-app_config["MANIFEST_FILE"] = "manifest.js"
 app_config["OVERLAY_FILE"] = "date_overlay.png"
 app_config["CUM_SPECIES_GRAPH"] = "cum_species_graph"
 app_config["BY_MONTH_GRAPH"] = "by_month_graph"
@@ -19,6 +18,14 @@ app_config["LOG_FILE"] = "moth_bottle.log"
 app_config["REQUESTS_LOG_FILE"] = "requests.log"
 app_config["TAXONOMY_TABLE"] = "irecord_taxonomy"
 app_config["DB_UPDATE_TIME_FILE"] = "db_update_time.flag"
+app_config["GRAPH_CACHE_BYTES"] = 32 * 1024 * 1024  # Graph JSON kept in GRAPH_PATH
+app_config["RECORDS_BACKUP"] = False  # Also save each survey to day_count_YYYYMMDD.json
+app_config["JOURNAL_FILE"] = "survey_journal.jsonl"  # Surveys not yet saved
+app_config["JOURNAL_WAIT"] = 2.0  # Seconds a survey waits to be saved before replying
+app_config["MANIFEST_CACHE"] = 32  # Survey sheet manifests kept in memory, one per date
+app_config["WARM_SPECIES"] = 10  # Species pages built in the background, most caught
+app_config["WARMUP_QUEUE"] = 32  # Most background jobs waiting at once
+app_config["RELOADER"] = False  # Restart on code changes (but imports everything twice)
 
 
 # Test paths exist and create them if missing
@@ -0,0 +1,150 @@
+""" compress.py
+
+Bottle plugin compressing responses for browsers that accept it.
+
+The summary, species, genus and family pages carry large plotly JSON, and
+common_names.js lists every moth name, all of which went over the site Wi-Fi
+uncompressed. Responses of at least MIN_SIZE bytes of text are now sent with gzip
+(or brotli, if the brotli package is installed and the browser offers "br") as
+negotiated on Accept-Encoding.
+
+The pages are mostly served from the route and graph caches, so the same body is
+sent many times. Compressed bodies are kept in a small LRU keyed on the encoding and
+a hash of the body, so each version of a page is only compressed once.
+
+Usage:
+    app.install(compress.compress_response)
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from bottle import HTTPResponse, request, response
+
+try:
+    import brotli
+except ModuleNotFoundError:
+    brotli = None
+
+MIN_SIZE = 1024  # Not worth compressing below this
+CACHE_BYTES = 8 * 1024 * 1024
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json")
+
+ENCODERS = {"gzip": lambda data: gzip.compress(data, compresslevel=6)}
+if brotli is not None:
+    ENCODERS["br"] = lambda data: brotli.compress(data, quality=5)
+
+
+class CompressedBodies:
+    """ LRU of compressed bodies, up to max_bytes in total """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._bodies = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def compress(self, encoding, data):
+        key = (encoding, hashlib.sha1(data).digest())
+        with self._lock:
+            body = self._bodies.get(key)
+            if body is not None:
+                self._bodies.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+
+        body = ENCODERS[encoding](data)
+        with self._lock:
+            if key not in self._bodies:
+                self._bodies[key] = body
+                self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, old = self._bodies.popitem(last=False)
+                self._bytes -= len(old)
+        return body
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bodies": len(self._bodies),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+compressed_bodies = CompressedBodies()
+
+
+def accepted_encoding():
+    """ The best encoding offered in the request's Accept-Encoding, or None """
+    offered = {}
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[coding.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding in ENCODERS and offered.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+
+def _compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress_response(fn):
+    """ Bottle plugin: compress str/bytes bodies and static text files """
+
+    @wraps(fn)
+    def _compress_response(*args, **kwargs):
+        body = fn(*args, **kwargs)
+
+        if isinstance(body, HTTPResponse):
+            rsp = body  # e.g. static_file()
+            content_type = rsp.content_type or ""
+            if rsp.status_code != 200 or not _compressible(content_type):
+                return body
+            if hasattr(rsp.body, "read"):
+                with rsp.body as fin:
+                    rsp.body = fin.read()
+            data = rsp.body
+        elif isinstance(body, (str, bytes)):
+            rsp = response
+            content_type = rsp.content_type or "text/html"
+            if rsp.status_code != 200 or not _compressible(content_type):
+                return body
+            data = body.encode(rsp.charset) if isinstance(body, str) else body
+        else:
+            return body  # dicts are JSON encoded later, generators streamed
+
+        if not isinstance(data, bytes) or "Content-Encoding" in rsp.headers:
+            return body
+        rsp.add_header("Vary", "Accept-Encoding")
+        encoding = accepted_encoding()
+        if encoding is None or len(data) < MIN_SIZE:
+            return body
+
+        compressed = compressed_bodies.compress(encoding, data)
+        rsp.set_header("Content-Encoding", encoding)
+        rsp.set_header("Content-Length", str(len(compressed)))
+        if rsp is response:
+            return compressed
+        rsp.body = compressed
+        return body
+
+    return _compress_response
@@ -1,9 +1,12 @@
 import copy
 import getpass
 import glob
-import mysql.connector
 import pandas as pd
 
+import storage
+import update_moth_taxonomy
+from storage import connect_args
+
 try:
     from sql_config_local import sql_config
 except ModuleNotFoundError:
@@ -13,82 +16,75 @@ except ModuleNotFoundError:
 moth_names = max(glob.glob("????????_irecord_names.csv"))
 print("Using input file:", moth_names)
 
-# Generate root login
-root_config = copy.deepcopy(sql_config)
-del root_config["database"]
-root_config["user"] = "root"
-root_config["password"] = getpass.getpass(prompt="Database root password:")
+backend = storage.get_backend()
 
-cnx = mysql.connector.connect(**root_config)
-del root_config["password"]
-cursor = cnx.cursor()
+if backend.name == "mariadb":
+    import mysql.connector
 
-# Create database (if it doesn't exist)
-cursor.execute(f"CREATE DATABASE IF NOT EXISTS {sql_config['database']};")
-cursor.execute(
-    f"""CREATE USER IF NOT EXISTS '{sql_config["user"]}'@'localhost' 
-    IDENTIFIED BY '{sql_config["password"]}';"""
-)
-cursor.execute(
-    f"""GRANT ALL PRIVILEGES ON {sql_config['database']}.* 
-    TO '{sql_config["user"]}'@'localhost';"""
-)
-cursor.execute("FLUSH PRIVILEGES;")
-cursor.close()
-cnx.close()
+    # Generate root login
+    root_config = copy.deepcopy(connect_args(sql_config))
+    del root_config["database"]
+    root_config["user"] = "root"
+    root_config["password"] = getpass.getpass(prompt="Database root password:")
+
+    cnx = mysql.connector.connect(**root_config)
+    del root_config["password"]
+    cursor = cnx.cursor()
+
+    # Create database (if it doesn't exist)
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS {sql_config['database']};")
+    cursor.execute(
+        f"""CREATE USER IF NOT EXISTS '{sql_config["user"]}'@'localhost' 
+        IDENTIFIED BY '{sql_config["password"]}';"""
+    )
+    cursor.execute(
+        f"""GRANT ALL PRIVILEGES ON {sql_config['database']}.* 
+        TO '{sql_config["user"]}'@'localhost';"""
+    )
+    cursor.execute("FLUSH PRIVILEGES;")
+    cursor.close()
+    cnx.close()
 
-cnx = mysql.connector.connect(**sql_config)
+# A SQLite database file is created on first connection
+cnx = backend.connect(sql_config)
 cursor = cnx.cursor()
 
 # Create records table
 try:
     cursor.execute("DROP TABLE IF EXISTS moth_records;")
+    cursor.execute("DROP TABLE IF EXISTS rollup_month;")  # Rebuilt from the records
+    cursor.execute("DROP TABLE IF EXISTS survey_applied;")  # Saved survey ids
+    cursor.execute("DROP TABLE IF EXISTS schema_version;")  # Reapplied on next start
     cursor.execute(
         "CREATE TABLE  moth_records "
-        "(Id INT AUTO_INCREMENT PRIMARY KEY, Date DATE, MothName VARCHAR(50) "
+        f"({backend.AUTO_ID}, Date DATE, MothName VARCHAR(50) "
         "DEFAULT NULL, MothCount INT default 0);"
     )
-    cursor.execute("describe moth_records;")
-    for x in cursor:
-        print(x)
+    print(backend.column_defaults(cursor, "moth_records"))
 except Exception as e:
     print(e)
 
 
+# The first line of the csv is its header
 names_df = pd.read_csv(
     moth_names,
-    header=None,
-    names=["Common", "Family", "Sub-family", "Genus", "Species","TVK"],
+    header=0,
+    names=[
+        "MothName",
+        "MothFamily",
+        "MothSubFamily",
+        "MothGenus",
+        "MothSpecies",
+        "TVK",
+    ],
 ).fillna("")
-names_df.sort_values("Common", inplace=True)
 
 # Create and populate moth_taxonomy
-cursor.execute("DROP TABLE IF EXISTS irecord_taxonomy;")
-cursor.execute(
-    "CREATE TABLE irecord_taxonomy (Id INT AUTO_INCREMENT PRIMARY KEY,"
-    "MothName VARCHAR(50),"
-    "MothFamily VARCHAR(50) DEFAULT NULL,"
-    "MothSubFamily VARCHAR(50) DEFAULT NULL,"
-    "MothGenus VARCHAR(50) DEFAULT NULL,"
-    "MothSpecies VARCHAR(50) DEFAULT NULL,"
-    "TVK VARCHAR(50) DEFAULT NULL"
-    ");"
+update_moth_taxonomy.load_taxonomy(
+    cnx, cursor, "irecord_taxonomy", update_moth_taxonomy.taxonomy_rows(names_df)
 )
 
-cols = ",".join(["MothName", "MothFamily", "MothSubFamily", "MothGenus", "MothSpecies", "TVK"])
-
-print(cols)
-print(names_df.columns)
-for _, *row in names_df.itertuples():
-
-    print(tuple(row))
-    cursor.execute(
-        f"INSERT INTO irecord_taxonomy ({cols}) VALUES (%s,%s,%s,%s,%s,%s);", tuple(row)
-    )
-
-cursor.execute("DESCRIBE irecord_taxonomy;")
-for t in cursor:
-    print(t)
+print(backend.column_defaults(cursor, "irecord_taxonomy"))
 
 
 cnx.close()
@@ -0,0 +1,85 @@
+""" data_version.py
+
+Cheap data versions shared between server processes.
+
+Each kind of data (records, options, taxonomy...) has a flag file in
+cfg["RECORDS_PATH"] whose modification time, in nanoseconds, is its version. Anything
+that changes the data bumps the flag and anything caching the data compares the flag
+with the version it loaded. A stat() costs microseconds, so every process sees
+another's change on its next lookup without any messaging between them.
+
+This is the same trick as cfg["DB_UPDATE_TIME_FILE"], which is the records flag.
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import os
+import threading
+import time
+
+try:
+    from app_config_local import app_config as cfg
+except ModuleNotFoundError:
+    from app_config_default import app_config as cfg
+
+FLAG_FILES = {
+    "records": cfg["DB_UPDATE_TIME_FILE"],
+}
+
+
+def _flag_path(name):
+    return cfg["RECORDS_PATH"] + FLAG_FILES.get(name, f"{name}_update_time.flag")
+
+
+def version(name):
+    """ The current version of the named data, 0 if it has never been bumped. """
+    try:
+        return os.stat(_flag_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump(name):
+    """ Mark the named data as changed and return its new version.
+        The version always moves forward, even if the clock hasn't."""
+    path = _flag_path(name)
+    new_version = max(time.time_ns(), version(name) + 1)
+    with open(path, "a"):
+        pass
+    os.utime(path, ns=(new_version, new_version))
+    return new_version
+
+
+class VersionedCache:
+    """ Holds the value returned by loader() until the named data version changes.
+
+        Usage:
+            options_cache = VersionedCache("options", load_options)
+            options_cache.get()         # loads once, then served from memory
+            options_cache.invalidate()  # bumps the flag so every process reloads
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._value = None
+        self._version = None
+
+    def get(self):
+        current = version(self.name)
+        if current != self._version:
+            with self._lock:
+                if current != self._version:
+                    # Read the version before loading, so a change made during the
+                    # load is picked up next time round
+                    self._value = self.loader()
+                    self._version = current
+        return self._value
+
+    def invalidate(self):
+        """ Drop the cached value here, and in every other process. """
+        with self._lock:
+            self._version = None
+            bump(self.name)
@@ -0,0 +1,237 @@
+""" db_pool.py
+
+A small thread safe pool of database connections shared by moths_bottle and
+update_moth_taxonomy.
+
+Opening a fresh connection costs more on the Pi than most of the queries we run, so
+connections are checked out of the pool and handed back when the work is done.
+Connections that have sat idle are pinged before reuse and any that are older than
+`pool_recycle` seconds are closed and replaced.
+
+The pool is configured from sql_config:
+    pool_size           - maximum number of open connections (default 4)
+    pool_timeout        - seconds to wait for a free connection (default 10)
+    pool_recycle        - maximum age in seconds of a connection (default 3600)
+    pool_ping_interval  - idle seconds before a connection is pinged (default 30)
+
+History
+-------
+18 Oct 2026 - Connections are opened by the configured storage backend
+18 Oct 2026 - Genesis
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import storage
+
+try:
+    from sql_config_local import sql_config
+except ModuleNotFoundError:
+    from sql_config_default import sql_config
+
+# Keys in sql_config used by the pool, these are not passed to connect()
+POOL_DEFAULTS = {
+    "pool_size": 4,
+    "pool_timeout": 10,
+    "pool_recycle": 3600,
+    "pool_ping_interval": 30,
+}
+
+
+class PoolTimeout(Exception):
+    """ Raised when no connection becomes free within pool_timeout seconds. """
+
+
+class _PoolEntry:
+    """ A connection along with the book-keeping the pool needs. """
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class ConnectionPool:
+    """ A fixed size pool of connections created on demand by `connect`. """
+
+    def __init__(
+        self,
+        connect,
+        pool_size=4,
+        pool_timeout=10,
+        pool_recycle=3600,
+        pool_ping_interval=30,
+    ):
+        self._connect_fn = connect
+        self.size = pool_size
+        self.timeout = pool_timeout
+        self.recycle = pool_recycle
+        self.ping_interval = pool_ping_interval
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "connect_time": 0.0,
+            "recycled": 0,
+            "stale": 0,
+            "discarded": 0,
+        }
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _new_entry(self):
+        """ Open a new connection, recording how long it took. """
+        start = time.monotonic()
+        try:
+            cnx = self._connect_fn()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+            raise
+        with self._lock:
+            self._stats["connects"] += 1
+            self._stats["connect_time"] += time.monotonic() - start
+        return _PoolEntry(cnx)
+
+    def _close_entry(self, entry):
+        try:
+            entry.cnx.close()
+        except Exception:
+            pass  # It is already broken, which is why we are closing it
+
+    def _healthy(self, entry):
+        """ Recycle old connections and ping any that have been idle a while. """
+        now = time.monotonic()
+        if now - entry.created > self.recycle:
+            self._count("recycled")
+        elif now - entry.last_used > self.ping_interval and not self._ping(entry):
+            self._count("stale")
+        else:
+            return entry
+
+        self._close_entry(entry)
+        return self._new_entry()
+
+    @staticmethod
+    def _ping(entry):
+        try:
+            return entry.cnx.is_connected()
+        except Exception:
+            return False
+
+    def acquire(self):
+        """ Check out a connection, opening one if the pool isn't yet full. """
+        try:
+            entry = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._open < self.size
+                if can_open:
+                    self._open += 1
+            if can_open:
+                entry = self._new_entry()
+            else:
+                self._count("waits")
+                start = time.monotonic()
+                try:
+                    entry = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    self._count("timeouts")
+                    raise PoolTimeout(
+                        f"No database connection free after {self.timeout}s"
+                    )
+                finally:
+                    self._count("wait_time", time.monotonic() - start)
+
+        entry = self._healthy(entry)
+        self._count("checkouts")
+        return entry
+
+    def release(self, entry, discard=False):
+        """ Return a connection to the pool, or close it if it is no longer usable """
+        if discard:
+            self._close_entry(entry)
+            with self._lock:
+                self._open -= 1
+                self._stats["discarded"] += 1
+            return
+        entry.last_used = time.monotonic()
+        self._idle.put(entry)
+
+    @contextmanager
+    def connection(self):
+        """ Context manager yielding a connection that is returned on exit.
+
+            If the block raises, any open transaction is rolled back. A connection
+            that can't even do that is dropped rather than handed to the next caller.
+        """
+        entry = self.acquire()
+        try:
+            yield entry.cnx
+        except BaseException:
+            # BaseException as well, so an abandoned generator still returns it
+            try:
+                entry.cnx.rollback()
+            except Exception:
+                self.release(entry, discard=True)
+                raise
+            self.release(entry)
+            raise
+        else:
+            self.release(entry)
+
+    def close(self):
+        """ Close all idle connections. """
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.release(entry, discard=True)
+
+    def stats(self):
+        """ A snapshot of the pool counters for monitoring. """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["open"] = self._open
+        stats["size"] = self.size
+        stats["idle"] = self._idle.qsize()
+        stats["in_use"] = stats["open"] - stats["idle"]
+        stats["wait_time"] = round(stats["wait_time"], 4)
+        stats["connect_time"] = round(stats["connect_time"], 4)
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """ Return the shared pool, creating it from sql_config on first use. """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            options = {k: sql_config.get(k, v) for k, v in POOL_DEFAULTS.items()}
+            backend = storage.get_backend()
+            _pool = ConnectionPool(lambda: backend.connect(sql_config), **options)
+    return _pool
+
+
+def connection():
+    """ Shortcut for get_pool().connection() """
+    return get_pool().connection()
+
+
+def pool_stats():
+    """ Shortcut for get_pool().stats() """
+    return get_pool().stats()
@@ -0,0 +1,204 @@
+""" graph_cache.py
+
+A cache of rendered plotly graph JSON that survives a restart.
+
+The lru_caches on the pages are lost whenever the server restarts (and the Pi
+restarts on every update), leaving the first visitor to wait while the summary
+graphs are rebuilt. Graphs are now also saved under cfg["GRAPH_PATH"] + "cache/",
+one file per graph, named by the kind of graph and a hash of
+
+    its parameters, today's date and the data versions it was built from
+
+so a file can never be served once the records or taxonomy have changed (or the
+day has moved on). Stale files are simply never read again, and are removed when
+the cache grows beyond GRAPH_CACHE_BYTES, least recently used first.
+
+Files are written to a temporary name and renamed into place, so a power cut can't
+leave a half written graph. The directory is scanned on first use (not on import,
+so importing this module doesn't touch the disk) to pick up what is already there.
+
+Usage:
+    @graph_cache.cached("species", "records", "taxonomy")
+    def graph_species(name):
+        ...
+        return fig.to_json()
+
+History
+-------
+18 Oct 2026 - The cache is opened by get_graphs() on first use, not on import
+18 Oct 2026 - Genesis
+"""
+import datetime as dt
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from functools import wraps
+
+import data_version
+
+try:
+    from app_config_local import app_config as cfg
+except ModuleNotFoundError:
+    from app_config_default import app_config as cfg
+
+GRAPH_CACHE_BYTES = cfg.get("GRAPH_CACHE_BYTES", 32 * 1024 * 1024)
+
+moth_logger = logging.getLogger("moth_logger")
+
+
+class GraphCache:
+    """ Graph JSON strings stored as files in path, up to max_bytes in total. """
+
+    def __init__(self, path, max_bytes=GRAPH_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files = {}  # file name -> (last used, size)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(path, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        """ Index the graphs already on disk and tidy up any interrupted writes """
+        files = {}
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.endswith(".tmp"):
+                    os.remove(entry.path)
+                elif entry.name.endswith(".json"):
+                    st = entry.stat()
+                    files[entry.name] = (st.st_mtime, st.st_size)
+        with self._lock:
+            self._files = files
+        moth_logger.debug(f"Graph cache: {len(files)} graphs in {self.path}")
+
+    @staticmethod
+    def file_name(kind, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+        return f"{kind}_{digest}.json"
+
+    def get(self, kind, key):
+        """ The graph JSON stored for kind and key, or None """
+        name = self.file_name(kind, key)
+        with self._lock:
+            if name not in self._files:
+                self.misses += 1
+                return None
+        try:
+            with open(os.path.join(self.path, name), "r") as fin:
+                graph_json = fin.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._files.pop(name, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            if name in self._files:
+                self._files[name] = (dt.datetime.now().timestamp(), len(graph_json))
+                try:
+                    # So LRU order survives a restart
+                    os.utime(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    self._files.pop(name, None)  # Evicted by another process
+        return graph_json
+
+    def put(self, kind, key, graph_json):
+        """ Store graph_json for kind and key, then evict if over max_bytes """
+        name = self.file_name(kind, key)
+        fd, tmp_name = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fout:
+                fout.write(graph_json)
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.replace(tmp_name, os.path.join(self.path, name))
+        except OSError:
+            moth_logger.exception(f"Graph cache: failed to write {name}")
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return
+        with self._lock:
+            self._files[name] = (dt.datetime.now().timestamp(), len(graph_json))
+            self._evict()
+
+    def _evict(self):
+        total = sum(size for _, size in self._files.values())
+        for name, (_, size) in sorted(self._files.items(), key=lambda f: f[1][0]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            del self._files[name]
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """ Remove every cached graph """
+        with self._lock:
+            for name in self._files:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+            self._files = {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "graphs": len(self._files),
+                "bytes": sum(size for _, size in self._files.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_graphs = None
+_graphs_lock = threading.Lock()
+
+
+def get_graphs():
+    """ The GraphCache of cfg["GRAPH_PATH"], scanned on first use """
+    global _graphs
+    with _graphs_lock:
+        if _graphs is None:
+            _graphs = GraphCache(cfg["GRAPH_PATH"] + "cache/")
+    return _graphs
+
+
+def cached(kind, *data_names):
+    """ Decorator caching a function returning graph JSON in get_graphs().
+
+        kind        - names the files, e.g. cfg["CUM_SPECIES_GRAPH"]
+        data_names  - the data versions (see data_version.py) the graph depends on
+        The function's arguments and today's date are part of the key.
+        A result of None (e.g. nothing to plot) is not cached.
+    """
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args):
+            key = (
+                args,
+                dt.date.today().isoformat(),
+                tuple(data_version.version(name) for name in data_names),
+            )
+            graphs = get_graphs()
+            graph_json = graphs.get(kind, key)
+            if graph_json is None:
+                graph_json = fn(*args)
+                if graph_json is not None:
+                    graphs.put(kind, key, graph_json)
+            return graph_json
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,114 @@
+""" http_cache.py
+
+Conditional GET support for the pages built from the database.
+
+A browser refreshing /summary or a species page used to download the whole page,
+plotly JSON and all, even though nothing had changed. Decorated routes now send
+
+    ETag: W/"<hash of the route, its arguments, data versions and date>"
+    Last-Modified: <time the data (or the day) last changed>
+    Cache-Control: no-cache
+
+and a browser that sends the ETag back in If-None-Match (or a date in
+If-Modified-Since) gets an empty 304 Not Modified without the page being built.
+
+The data versions are the flag files of data_version.py, the same ones used by the
+server side caches. Pages that show today's date also change at midnight, and every
+page changes when the code or templates do. ETags are weak as the same page may be
+sent compressed or not.
+
+Usage:
+    @app.route("/summary")
+    @http_cache.conditional("records")
+    def get_summary():
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import datetime as dt
+import glob
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from functools import wraps
+
+from bottle import HTTPResponse, request, response
+
+import data_version
+
+# Changes when the code or templates are updated
+APP_VERSION = max(
+    (os.path.getmtime(f) for f in glob.glob("*.py") + glob.glob("views/*.tpl")),
+    default=0,
+)
+
+
+def _midnight():
+    """ Timestamp of the start of today """
+    return dt.datetime.combine(dt.date.today(), dt.time()).timestamp()
+
+
+def validators(route, args, data_names, by_date):
+    """ Returns (etag, last modified timestamp) for a page """
+    versions = [data_version.version(name) for name in data_names]
+    last_modified = max([v / 1e9 for v in versions] + [APP_VERSION])
+    key = [route, args, versions, APP_VERSION]
+    if by_date:
+        last_modified = max(last_modified, _midnight())
+        key.append(dt.date.today().isoformat())
+    digest = hashlib.sha1(repr(key).encode()).hexdigest()[:20]
+    return f'W/"{digest}"', last_modified
+
+
+def not_modified(etag, last_modified):
+    """ True if the request's conditional headers match the page """
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or (
+            if_none_match.strip() == "*"
+        )
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= since
+    return False
+
+
+def conditional(*data_names, by_date=False):
+    """ Decorator adding ETag/Last-Modified headers to a GET route and answering
+        matching conditional requests with 304 Not Modified.
+
+        data_names  - the data versions (see data_version.py) the page depends on
+        by_date     - True if the page depends on today's date
+    """
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return fn(*args, **kwargs)
+
+            etag, last_modified = validators(
+                fn.__name__, (args, sorted(kwargs.items())), data_names, by_date
+            )
+            headers = {
+                "ETag": etag,
+                "Last-Modified": formatdate(last_modified, usegmt=True),
+                "Cache-Control": "no-cache",
+            }
+            if not_modified(etag, last_modified):
+                return HTTPResponse(status=304, headers=headers)
+
+            body = fn(*args, **kwargs)
+            for name, value in headers.items():
+                response.set_header(name, value)
+            return body
+
+        return wrapper
+
+    return decorator
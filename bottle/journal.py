@@ -0,0 +1,274 @@
+""" journal.py
+
+A write-ahead journal of survey submissions.
+
+If the database was restarting or slow, a submitted survey sheet failed and the
+night's records were only left in the browser's sessionStorage. A submission is now
+appended to a local journal file (one JSON line each, fsynced) before anything else,
+so once survey_handler has it, it is kept. A worker thread replays the journal into
+the database, in batches, in the order it was written, retrying with a growing delay
+while the database is unavailable.
+
+An entry that fails for any other reason (bad data the database won't take) is
+tried MAX_ATTEMPTS times, then moved to the dead letter file (the journal's path
+with DEAD_LETTER_SUFFIX) with its error, so it can't hold up the entries behind it.
+
+The same sheet submitted twice in a row (a double tap, or a browser resending the
+POST) is only replayed once. As each entry is applied a {"done": id} line is
+appended, so after a restart the worker carries on from the first entry not done.
+An entry can still be replayed twice (if the server stops between applying it and
+marking it done, or another server process shares the journal and replays its
+entries after a restart), so apply() should skip an entry["id"] it has already
+applied. Once all of a process's entries are applied the journal is rewritten
+without the entries done, keeping any another process has still to apply; writes
+and rewrites hold a lock on the journal's path with LOCK_SUFFIX.
+
+Usage:
+    survey_journal = journal.SurveyJournal(path, apply=save_survey)
+    entry_id = survey_journal.append({"date": "2020-06-21", ...})
+    applied, result = survey_journal.wait(entry_id, timeout=2)
+    survey_journal.stats()   # shown in /status
+
+History
+-------
+18 Oct 2026 - Dead letter entries that keep failing, and share the file safely
+18 Oct 2026 - Genesis
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+moth_logger = logging.getLogger("moth_logger")
+
+BATCH_SIZE = 20
+RETRY_DELAYS = (1, 2, 5, 10, 30, 60)  # seconds, the last repeated until it works
+MAX_ATTEMPTS = 3  # Tries of an entry failing other than transiently
+DEAD_LETTER_SUFFIX = ".failed"
+LOCK_SUFFIX = ".lock"
+
+
+class SurveyJournal:
+    """ Journal file of submissions, replayed by a daemon thread.
+
+        apply(entry) writes one entry to the database, returning a result for
+        wait(). after_batch(entries), if given, is called after each batch.
+        is_transient(error) is True for errors to retry for as long as they last,
+        e.g. the database being down.
+    """
+
+    def __init__(
+        self,
+        path,
+        apply,
+        after_batch=None,
+        batch_size=BATCH_SIZE,
+        is_transient=lambda error: False,
+        max_attempts=MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.apply = apply
+        self.after_batch = after_batch
+        self.batch_size = batch_size
+        self.is_transient = is_transient
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._pending = self._load()  # entries not yet applied, oldest first
+        self._waiting = {}  # id -> result once applied, None until then
+        self._attempts = {}  # id -> failed attempts, of entries failing
+        self._thread = None
+        self._last = self._last_result = None  # The entry applied last, its result
+        self.applied = 0
+        self.duplicates = 0
+        self.retries = 0
+        self.failed = 0
+        self.last_error = None
+        self.last_batch = None  # (entries, seconds)
+
+    @contextmanager
+    def _locked(self):
+        """ Hold the journal's file lock, shared by every process using it """
+        with open(self.path + LOCK_SUFFIX, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _read(self):
+        """ The entries in the journal file, and the set of ids marked done """
+        entries, done = [], set()
+        try:
+            with open(self.path) as fin:
+                for line in fin:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue  # A line cut short by a crash was never acknowledged
+                    if "done" in item:
+                        done.add(item["done"])
+                    else:
+                        entries.append(item)
+        except FileNotFoundError:
+            pass
+        return entries, done
+
+    def _load(self):
+        """ The entries in the journal file not yet marked done. The file is
+            rewritten with just them, so a line a crash cut short is dropped rather
+            than run into the next line written. """
+        pending = self._compact()
+        if pending:
+            moth_logger.info(f"Journal: {len(pending)} submissions to replay")
+        return pending
+
+    def _write(self, item, path=None):
+        """ Append item to the journal (or path), returning once it is on disk """
+        with self._locked(), open(path or self.path, "a") as fout:
+            fout.write(json.dumps(item) + "\n")
+            fout.flush()
+            os.fsync(fout.fileno())
+
+    def _compact(self):
+        """ Rewrite the journal without the entries done, by any process.
+            Returns the entries left. """
+        with self._locked():
+            entries, done = self._read()
+            pending = [entry for entry in entries if entry["id"] not in done]
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as fout:
+                for entry in pending:
+                    fout.write(json.dumps(entry) + "\n")
+                fout.flush()
+                os.fsync(fout.fileno())
+            os.replace(temp_path, self.path)
+        return pending
+
+    def append(self, entry):
+        """ Journal entry (a JSON-able dict), to be applied by the worker.
+            Returns its id. """
+        entry = dict(entry, id=uuid.uuid4().hex, time=time.time())
+        with self._cond:
+            self._write(entry)
+            self._pending.append(entry)
+            self._waiting[entry["id"]] = None
+            self._cond.notify_all()
+        self.start()
+        return entry["id"]
+
+    def wait(self, entry_id, timeout):
+        """ Wait up to timeout seconds for entry_id to be applied.
+            Returns (True, apply's result) if it was, else (False, None). """
+        with self._cond:
+            applied = self._cond.wait_for(
+                lambda: self._waiting.get(entry_id) is not None, timeout
+            )
+            result = self._waiting.pop(entry_id, None)
+        return (True, result[0]) if applied else (False, None)
+
+    def start(self):
+        """ Start the worker, if it isn't running """
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="journal", daemon=True
+                )
+                self._thread.start()
+
+    def _same(self, entry, previous):
+        return previous is not None and all(
+            entry[key] == previous[key] for key in entry if key not in ("id", "time")
+        )
+
+    def _run(self):
+        failures = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                batch = self._pending[0 : self.batch_size]
+
+            start = time.perf_counter()
+            done = []
+            try:
+                for entry in batch:
+                    if self._same(entry, self._last):
+                        result = self._last_result
+                        self.duplicates += 1
+                    else:
+                        result = self.apply(entry)
+                        self.applied += 1
+                    self._last, self._last_result = entry, result
+                    self._mark_done(entry, result)
+                    done.append(entry)
+                failures = 0
+            except Exception as e:
+                self.last_error = f"{time.strftime('%H:%M:%S')} {e!r}"
+                if self._failed(entry, e):
+                    failures = 0  # Carry on with the entries behind it
+                else:
+                    self.retries += 1
+                    delay = RETRY_DELAYS[min(failures, len(RETRY_DELAYS) - 1)]
+                    failures += 1
+                    moth_logger.warning(
+                        f"Journal: replay failed, retrying in {delay}s: {e!r}"
+                    )
+
+            if done:
+                self.last_batch = (len(done), round(time.perf_counter() - start, 3))
+                if self.after_batch is not None:
+                    try:
+                        self.after_batch(done)
+                    except Exception:
+                        moth_logger.exception("Journal: after_batch failed")
+            if failures:
+                time.sleep(delay)
+
+    def _failed(self, entry, error):
+        """ Count a failed attempt at entry. Returns True if it has been moved to
+            the dead letter file, rather than being retried. """
+        if self.is_transient(error):
+            return False
+        attempts = self._attempts.get(entry["id"], 0) + 1
+        self._attempts[entry["id"]] = attempts
+        if attempts < self.max_attempts:
+            return False
+
+        moth_logger.error(
+            f"Journal: {entry['id']} failed {attempts} times, moved to "
+            f"{self.path + DEAD_LETTER_SUFFIX}: {error!r}"
+        )
+        self._write(
+            dict(entry, error=repr(error), failed=time.time()),
+            self.path + DEAD_LETTER_SUFFIX,
+        )
+        self.failed += 1
+        self._mark_done(entry, None, applied=False)
+        return True
+
+    def _mark_done(self, entry, result, applied=True):
+        with self._cond:
+            self._write({"done": entry["id"]})
+            self._pending.remove(entry)
+            self._attempts.pop(entry["id"], None)
+            if entry["id"] in self._waiting:
+                if applied:
+                    self._waiting[entry["id"]] = (result,)
+                else:
+                    del self._waiting[entry["id"]]  # wait() times out, not applied
+            if not self._pending:
+                self._compact()  # Start the file afresh, bar other processes' entries
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "oldest": self._pending[0]["time"] if self._pending else None,
+                "applied": self.applied,
+                "duplicates": self.duplicates,
+                "retries": self.retries,
+                "failed": self.failed,
+                "last_error": self.last_error,
+                "last_batch": self.last_batch,
+            }
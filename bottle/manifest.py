@@ -0,0 +1,141 @@
+""" manifest.py
+
+The survey sheet's manifest: the species likely to be caught on a date, with how
+many were caught over the week before it.
+
+refresh_manifest() used to rewrite static/manifest.js on every survey sheet request,
+and the sheet then fetched that file. Every sheet cost a file write, and two sheets
+opened for different dates at the same time could each be sent the other's list.
+Manifests are now built per date and kept in memory, and moths_bottle writes them
+into the survey sheet (or serves them from /manifest/<date>).
+
+A manifest is built from the records of the WINDOW_DAYS days up to its date, so
+when a night's survey is submitted invalidate() drops just the manifests of that
+night and the WINDOW_DAYS - 1 nights after it. If the records are changed by another
+process (the "records" data version moves without invalidate() being called here)
+every manifest is dropped.
+
+Usage:
+    manifests = manifest.Manifests()
+    manifests.get("2020-06-21")         # [{"species": .., "recent": .., "count": 0}]
+    manifests.invalidate("2020-06-19")  # after changing 2020-06-19's records
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import datetime as dt
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import data_version
+import db_pool
+
+WINDOW_DAYS = 7
+
+
+def _to_date(date):
+    return dt.date.fromisoformat(str(date)[0:10])
+
+
+def _fetch_window(date):
+    """ Total caught of each species on each of the WINDOW_DAYS days up to date """
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            "SELECT MothName, Date, SUM(MothCount) FROM moth_records "
+            "WHERE MothName != 'None' AND Date > %s AND Date <= %s "
+            "GROUP BY Date, MothName;",
+            (str(date - dt.timedelta(days=WINDOW_DAYS)), str(date)),
+        )
+        records = pd.DataFrame(cursor.fetchall(), columns=["species", "Date", "recent"])
+        cursor.close()
+    return records
+
+
+def likely_species(records):
+    """ The species of records seen on more than one day, or on either of the last
+        two days anything was recorded, with the total caught. Singletons from
+        earlier in the week are left out. """
+    if records.empty:
+        return []
+    counts = records.astype({"recent": float}).pivot(
+        index="species", columns="Date", values="recent"
+    )
+    regular = counts.count(axis=1) > 1
+    seen_recently = counts[counts.columns[-2:]].sum(axis=1) > 0
+    recent = counts.loc[regular | seen_recently].sum(axis=1).astype(int)
+    return [
+        {"species": species, "recent": total, "count": 0}
+        for species, total in zip(recent.index, recent.tolist())
+    ]
+
+
+class Manifests:
+    """ LRU of up to maxsize manifests, one per date """
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._manifests = OrderedDict()  # date -> list of species dicts
+        self._version = None
+        self._generation = 0  # Moves on whenever manifests are dropped
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def _check_version(self):
+        """ Drop everything if the records were changed behind our back """
+        version = data_version.version("records")
+        if version != self._version:
+            self._manifests.clear()
+            self._version = version
+            self._generation += 1
+
+    def get(self, date):
+        """ The manifest of date (a date or "YYYY-MM-DD") """
+        date = _to_date(date)
+        with self._lock:
+            self._check_version()
+            manifest = self._manifests.get(date)
+            if manifest is not None:
+                self._manifests.move_to_end(date)
+                self.hits += 1
+                return manifest
+            self.misses += 1
+            generation = self._generation
+
+        manifest = likely_species(_fetch_window(date))
+        with self._lock:
+            # Don't keep it if the records changed while it was being built
+            if generation == self._generation:
+                self._manifests[date] = manifest
+                while len(self._manifests) > self.maxsize:
+                    self._manifests.popitem(last=False)
+        return manifest
+
+    def invalidate(self, date):
+        """ Drop the manifests built from date's records. Call after changing them. """
+        date = _to_date(date)
+        with self._lock:
+            stale = [
+                day
+                for day in self._manifests
+                if 0 <= (day - date).days < WINDOW_DAYS
+            ]
+            for day in stale:
+                del self._manifests[day]
+            self.invalidated += len(stale)
+            self._version = data_version.version("records")
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "dates": [str(day) for day in self._manifests],
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+            }
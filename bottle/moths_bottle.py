@@ -27,6 +27,31 @@ data of bio-survey.
   * Food plant correlation and prediction
 
 ### History
+    18 Oct 2026 - The survey journal and graph cache are opened on first use
+    18 Oct 2026 - Conflicts of a queued survey are shown when its sheet is next opened
+    18 Oct 2026 - Surveys checked before journalling, and saved once per submission
+    18 Oct 2026 - Surveys journalled to disk first, then saved by a background worker
+    18 Oct 2026 - Sheets for the same night merge per species, conflicts shown
+    18 Oct 2026 - Surveys saved in one transaction, writing only the rows that changed
+    18 Oct 2026 - Survey records read from the database, JSON files an optional backup
+    18 Oct 2026 - Survey sheet manifests built per date in memory, not in manifest.js
+    18 Oct 2026 - Popular pages are built in the background after a start or survey
+    18 Oct 2026 - Faster start: markdown imported on first use, startup times logged
+    18 Oct 2026 - Graph JSON written directly by plotly_json, without graph_objects
+    18 Oct 2026 - Responses are gzip (or brotli) compressed, once per page version
+    18 Oct 2026 - Data pages support conditional GET (ETag, Last-Modified and 304)
+    18 Oct 2026 - Submitting a survey only clears the cached pages it affects
+    18 Oct 2026 - Rendered graphs are cached on disk so they survive a restart
+    18 Oct 2026 - Genus, subfamily and family pages share a cached rank engine
+    18 Oct 2026 - Graphs share vectorized day of year mapping from seasonal.py
+    18 Oct 2026 - Cumulative species graph built from first sightings, not a pivot
+    18 Oct 2026 - Summary and species lists read monthly totals kept in rollup_month
+    18 Oct 2026 - Routes resolve synonyms and ranks from an in memory taxonomy cache
+    18 Oct 2026 - Column defaults and option lists are cached until an option changes
+    18 Oct 2026 - Survey sheet data is loaded concurrently with a timing breakdown
+    18 Oct 2026 - Added an embedded SQLite storage backend as an option to MariaDB
+    18 Oct 2026 - Summary, species and export queries fetch typed columns
+    18 Oct 2026 - Database connections are now pooled, see /status for statistics
     30 Jun 2022 - Fixed a bug exposed by latest pandas
     31 Jan 2021 - Pulled 'Site name' out of comment into its own column for export
     17 Jan 2021 - Fixed graph x-axis to use a leap year 2000 as base
@@ -115,55 +140,70 @@ data of bio-survey.
 
 
 """
+import startup  # First, so the imports below are timed
+
 import os
 import json
+import hashlib
 import html
 import time
 import re
+import threading
 import datetime as dt
 import logging
 import logging.handlers
-from functools import wraps, lru_cache
-from markdown import markdown
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
 
 import numpy as np
 from bottle import Bottle, template, static_file, TEMPLATE_PATH, request, response, run
 import pandas as pd
-import mysql.connector as mariadb
 
 # from werkzeug.middleware.profiler import ProfilerMiddleware
 
-try:
-    import plotly.graph_objects as go
-except ModuleNotFoundError:
-    try:
-        import subprocess
-        import sys
-
-        def install(package):
-            subprocess.check_call([sys.executable, "-m", "pip", "install", package])
-
-        install("plotly")
-        import plotly.graph_objects as go
-    except ModuleNotFoundError:
-        print("Still can't import plotly!!!")
-
-try:
-    from sql_config_local import sql_config
-except ModuleNotFoundError:
-    from sql_config_default import sql_config
 try:
     from app_config_local import app_config as cfg
 except ModuleNotFoundError:
     from app_config_default import app_config as cfg
+import columnar
+import compress
+import data_version
+import db_pool
+import graph_cache
+import http_cache
+import journal
+import manifest
+import plotly_json
+import rollups
+import route_cache
+import schema_cache
+import seasonal
+import species_curve
+import storage
+import taxon_rank
+import taxonomy_cache
 import update_moth_taxonomy
-
-pd.options.plotting.backend = "plotly"
-BASE_YEAR = 2000  # Needs to be a leap year so we can map all days onto the same graph
+import warmup
+
+BASE_YEAR = seasonal.BASE_YEAR
+species_curves = species_curve.SpeciesCurves()
+manifests = manifest.Manifests(cfg.get("MANIFEST_CACHE", 32))
+
+# dtypes used by get_table(..., dtypes=RECORD_DTYPES) for the moth_records columns
+RECORD_DTYPES = {
+    "Date": "datetime64[ns]",
+    "Year": "int16",
+    "Month": "int8",
+    "MothCount": "int32",
+    "Quantity": "Int32",  # Nullable, so a NULL count is exported as before
+    "MothName": "category",
+    "TVK": "category",
+    "Location": "category",
+}
 
 # Set up plotly theme
 this_year = dt.date.today().year
-line_layout = go.Layout(
+line_layout = dict(
     autosize=False,
     width=1000,
     height=450,
@@ -213,25 +253,59 @@ sql_file_handler.setFormatter(sql_formatter)
 sql_logger.addHandler(sql_file_handler)
 
 
-def get_table(sql_query, multi=False):
-    """ Creates a pandas DataFrame from a SQL Query"""
+def get_table(sql_query, multi=False, dtypes=None, params=None):
+    """ Creates a pandas DataFrame from a SQL Query
+        If dtypes is given, e.g. RECORD_DTYPES, the columns are fetched in batches
+        straight into typed arrays (see columnar.py)
+        params are substituted for %s placeholders by the database driver"""
 
-    # Establish a connection to the SQL server
+    # Borrow a connection to the SQL server from the pool
     start = time.time()
-    cnx = mariadb.connect(**sql_config)
-    cursor = cnx.cursor()
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
 
-    cursor.execute(sql_query, multi=multi)
-    data_list = [list(c) for c in cursor]
-    count_df = pd.DataFrame(data_list, columns=list(cursor.column_names))
+        cursor.execute(sql_query, params, multi=multi)
+        if dtypes is None:
+            data_list = [list(c) for c in cursor]
+            count_df = pd.DataFrame(data_list, columns=list(cursor.column_names))
+        else:
+            count_df = columnar.frame_from_cursor(cursor, dtypes)
 
-    cursor.close()
-    cnx.close()
+        cursor.close()
     one_line_query = re.sub("[\n\\s]+", " ", sql_query)
     sql_logger.debug(f"{time.time()-start}\t{len(count_df)}\t{one_line_query}")
     return count_df
 
 
+def get_named_records(sql_query, names, **kwargs):
+    """ get_table for a query restricted to a list of moth names, which replaces
+        the {names} placeholder as an IN (...) list, e.g.
+            "SELECT ... FROM moth_records WHERE MothName IN ({names})"
+        The names are passed as params so apostrophes (Bird's-nest) are safe."""
+    names = list(names) or [None]  # IN (NULL) matches nothing
+    placeholders = ", ".join(["%s"] * len(names))
+    return get_table(
+        sql_query.replace("{names}", placeholders), params=tuple(names), **kwargs
+    )
+
+
+def iter_table(sql_query, dtypes=RECORD_DTYPES, chunksize=50000):
+    """ Generator version of get_table yielding typed DataFrames of chunksize rows
+        for result sets too large to comfortably hold in memory at once."""
+
+    start = time.time()
+    rows = 0
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(sql_query)
+        for chunk_df in columnar.iter_frames(cursor, dtypes, chunksize):
+            rows += len(chunk_df)
+            yield chunk_df
+        cursor.close()
+    one_line_query = re.sub("[\n\\s]+", " ", sql_query)
+    sql_logger.debug(f"{time.time()-start}\t{rows}\t{one_line_query}")
+
+
 def log_to_logger(fn):
     """ Wrap a Bottle request so that a log line is emitted after it's handled.
     (This decorator can be extended to take the desired logger as a param.) """
@@ -256,102 +330,249 @@ def log_to_logger(fn):
     return _log_to_logger
 
 
-def refresh_manifest(dash_date_str):
-    """ The manifest.js file is a list of the most likely moths to be caught
-        along with the number of recently caught speciments."""
+def _night_changes(sql_date_string, stored, wanted):
+    """ The changes turning a night's stored records into the wanted ones.
 
-    # reject singletons in most recent two catches.
-    manifest = (
-        get_table(
-            f"""SELECT MothName species, Date, SUM(MothCount) recent
-            FROM moth_records WHERE
-            MothName != "None" AND
-            Date > DATE_ADD(DATE("{dash_date_str}"), INTERVAL -7 DAY) AND
-            Date <= DATE("{dash_date_str}") GROUP BY Date, species;"""
-        )
-        .set_index(["species", "Date"])
-        .unstack("Date")
-    )
+        stored - the night's (Id, MothName, MothCount, Location, Recorder, Trap) rows
+        wanted - {MothName: (MothCount, Location, Recorder, Trap)}, empty if the trap
+                 was run but caught nothing, which is kept as one row without a name
 
-    regular = manifest.count(axis=1) > 1
-    last_two_dates = manifest.columns[-2:]
-    seen_recently = manifest[last_two_dates].sum(axis=1) > 0
-    recent_df = manifest.loc[regular | seen_recently].sum(axis=1).reset_index()
-    recent_df.columns = ["species", "recent"]
-
-    # generate javascript file to be sent to browsers
-    with open(cfg["STATIC_PATH"] + cfg["MANIFEST_FILE"], "w") as mout:
-        mout.write("var recent_moths  = [\n")
-        for _, r in recent_df.iterrows():
-            mout.write(
-                f'    {{species:"{r.species}", recent:{int(r.recent)}, count:0 }},\n'
-            )
-        mout.write("];")
+        Returns (inserts, updates, deletes, needs_marker, changed names), the first
+        three being parameters for the statements in update_moth_database().
+    """
+    updates, deletes = [], []
+    changed = set()
+    seen = set()
+    for row_id, name, *values in stored:
+        keep = name not in seen and (not wanted if name is None else name in wanted)
+        seen.add(name)
+        if not keep:
+            deletes.append((row_id,))
+            changed.add(name)
+        elif name is not None and tuple(values) != wanted[name]:
+            updates.append((*wanted[name], row_id))
+            changed.add(name)
+    inserts = [
+        (sql_date_string, name, *values)
+        for name, values in wanted.items()
+        if name not in seen
+    ]
+    changed.update(name for name in wanted if name not in seen)
+    needs_marker = not wanted and None not in seen
+    return inserts, updates, deletes, needs_marker, changed - {None}
+
+
+RECORD_FIELDS = ("count", "location", "recorder", "trap")
+# The largest values moth_records holds: MothCount INT, MothName VARCHAR(50) and the
+# option columns CHAR(30)
+MAX_COUNT = 2147483647  # 2^31 - 1
+MAX_LENGTHS = {"name": 50, "location": 30, "recorder": 30, "trap": 30}
+APPLIED_TABLE = update_moth_taxonomy.APPLIED_TABLE
+
+
+def record_problem(name, record):
+    """ Why the record ({RECORD_FIELDS}) of name can't be stored, or None """
+    if not 0 < record["count"] <= MAX_COUNT:
+        return f"{name}: a count of {record['count']} is out of range"
+    values = dict(record, name=name)
+    for field, length in MAX_LENGTHS.items():
+        if not isinstance(values[field], str):
+            return f"{name}: the {field} isn't text"
+        if len(values[field]) > length:
+            return f"{name}: the {field} is over {length} characters"
+    return None
+
+
+def record_version(values):
+    """ Version of a species' record for a night, values being its (MothCount,
+        Location, Recorder, Trap), or None if it has none. The survey sheet sends
+        back the version each species was loaded at, to merge it with other sheets.
+    """
+    if values is None:
+        return ""
+    return hashlib.sha1(repr(tuple(values)).encode()).hexdigest()[:12]
 
 
-def update_moth_database(cursor, sql_date_string, dict_records):
-    """ Update the mysql server with the latest records
-    """
+def _merge_night(stored, wanted, based_on):
+    """ Merge a sheet's changes into the night's stored records.
 
-    # touch the records file so we know we have updated the database.
-    # This is a workaround as not all databases store when they were updated.
-    with open(cfg["RECORDS_PATH"] + cfg["DB_UPDATE_TIME_FILE"], "w"):
-        pass
+        based_on - {MothName: record_version()} of each species on the sheet, as it
+                   was when the sheet was loaded
 
-    # delete any records for today
-    cursor.execute("DELETE FROM moth_records WHERE Date = %s;", (sql_date_string,))
+        A species the sheet changed is taken from wanted, unless another sheet has
+        changed it since, which is a conflict and left as stored. Species this sheet
+        left alone, or never showed, are left as stored.
+        Returns (the merged wanted records, [conflict dicts]).
+    """
+    current = {}
+    for _, name, *values in stored:
+        if name is not None:
+            current.setdefault(name, tuple(values))
+
+    merged = dict(current)
+    conflicts = []
+    for name, base in based_on.items():
+        mine, theirs = wanted.get(name), current.get(name)
+        if record_version(mine) == base or mine == theirs:
+            continue
+        if record_version(theirs) != base:
+            conflicts.append(
+                {
+                    "species": name,
+                    "yours": mine and dict(zip(RECORD_FIELDS, mine)),
+                    "stored": theirs and dict(zip(RECORD_FIELDS, theirs)),
+                }
+            )
+        elif mine is None:
+            del merged[name]
+        else:
+            merged[name] = mine
+    return merged, conflicts
+
+
+def update_moth_database(
+    cnx,
+    cursor,
+    sql_date_string,
+    dict_records,
+    based_on=None,
+    entry_id=None,
+    submitted=None,
+):
+    """ Update the mysql server with the latest records for a night.
+
+        Only the species rows that changed are inserted, updated or deleted, all in
+        one transaction so readers never see the night half written.
+        If based_on is given, the records are merged with the stored ones (see
+        _merge_night), rather than replacing them.
+        entry_id, the id of the journal entry being saved, is stored in the same
+        transaction, and if it already was nothing is written again. The time it
+        was submitted and its conflicts are stored with it, for survey_conflicts().
+        Returns ({"inserted": n, "updated": n, "deleted": n}, changed names,
+        conflicts).
+    """
+    wanted = {
+        k.replace("_", " "): (v["count"], v["location"], v["recorder"], v["trap"])
+        for k, v in dict_records.items()
+        if k != "nan" and v["count"] > 0
+    }
+
+    cnx.start_transaction()
+    cursor.execute(
+        "SELECT Id, MothName, MothCount, Location, Recorder, Trap "
+        f"FROM moth_records WHERE Date = %s{storage.get_backend().FOR_UPDATE};",
+        (sql_date_string,),
+    )
+    stored = cursor.fetchall()
+    if entry_id is not None:
+        cursor.execute(
+            f"SELECT EntryId FROM {APPLIED_TABLE} "
+            f"WHERE EntryId = %s{storage.get_backend().FOR_UPDATE};",
+            (entry_id,),
+        )
+        if cursor.fetchall():
+            cnx.rollback()
+            moth_logger.info(f"Survey {sql_date_string} {entry_id} already saved")
+            return {"inserted": 0, "updated": 0, "deleted": 0}, set(), []
+
+    conflicts = []
+    if based_on is not None:
+        wanted, conflicts = _merge_night(stored, wanted, based_on)
+    inserts, updates, deletes, needs_marker, changed = _night_changes(
+        sql_date_string, stored, wanted
+    )
 
-    if not dict_records:
+    if deletes:
+        cursor.executemany("DELETE FROM moth_records WHERE Id = %s", deletes)
+    if updates:
+        cursor.executemany(
+            "UPDATE moth_records SET MothCount = %s, Location = %s, Recorder = %s, "
+            "Trap = %s WHERE Id = %s",
+            updates,
+        )
+    if inserts:
+        cursor.executemany(
+            "INSERT INTO moth_records "
+            "(Date, MothName, MothCount, Location, Recorder, Trap) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            inserts,
+        )
+    if needs_marker:
         # If no moths recorded, add a null entry to identify we did trap on this date.
         cursor.execute(
             "INSERT INTO moth_records (Date) VALUES (%s);", (sql_date_string,)
         )
-    else:
-        # add updates
-        ins_list = [
-            '("{}", "{}", {}, "{}", "{}", "{}")'.format(
-                sql_date_string,
-                k.replace("_", " "),
-                v["count"],
-                v["location"],
-                v["recorder"],
-                v["trap"],
-            )
-            for k, v in dict_records.items()
-            if k != "nan" and v["count"] > 0
-        ]
+    touched = {
+        "inserted": len(inserts) + needs_marker,
+        "updated": len(updates),
+        "deleted": len(deletes),
+    }
 
-        ins_string = ", ".join(ins_list)
+    if any(touched.values()):
+        # Keep the month's totals in step with the records
+        rollups.update_month(cursor, sql_date_string)
+    if entry_id is not None:
         cursor.execute(
-            "INSERT INTO moth_records "
-            "(Date, MothName, MothCount, Location, Recorder, Trap) VALUES {};".format(
-                ins_string
-            )
+            f"INSERT INTO {APPLIED_TABLE} (EntryId, Date, Submitted, Conflicts) "
+            "VALUES (%s, %s, %s, %s);",
+            (
+                entry_id,
+                sql_date_string,
+                submitted,
+                json.dumps(conflicts) if conflicts else None,
+            ),
         )
+    cnx.commit()
+
+    if any(touched.values()):
+        # Move the records version (the DB_UPDATE_TIME_FILE flag) on, so every
+        # process drops what it cached from them. It also stands in for the update
+        # time of databases that don't store when they were updated.
+        data_version.bump("records")
+    return touched, changed, conflicts
 
 
-def generate_records_file(cursor, date_dash_str):
-    """ Ensure the records file cfg['RECORD_PATH'] exists
-        This file contains the {moth(with underscords): count:str} dict in json form
+def get_night_records(date_dash_str):
+    """ The records of a night, as the {moth (with underscores): {count, location,
+        recorder, trap}} dict also kept in the records files.
     """
-    #   columns = []
     records_df = get_table(
-        f"""SELECT MothName species, MothCount count,
+        """SELECT MothName species, MothCount count,
             Location location, Recorder recorder, Trap trap FROM moth_records
-            WHERE Date='{date_dash_str}' AND MothName != 'NULL';"""
+            WHERE Date = %s AND MothName != 'NULL';""",
+        params=(date_dash_str,),
     )
     records_df["species"] = records_df.species.apply(lambda s: s.replace(" ", "_"))
     records_df.set_index("species", inplace=True)
     records_dict = records_df.to_dict(orient="index")
 
     moth_logger.debug(records_dict)
-    with open(
-        f"{cfg['RECORDS_PATH']}day_count_{date_dash_str.replace('-','')}.json", "w"
-    ) as json_out:
-        json_out.write(json.dumps(records_dict))
     return records_dict
 
 
+# One worker thread writing the optional day_count_YYYYMMDD.json backups
+backup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backup")
+
+
+def _write_records_file(date_dash_str):
+    """ Write a night's records, as they now are in the database, to its file """
+    fout_json = f"{cfg['RECORDS_PATH']}day_count_{date_dash_str.replace('-', '')}.json"
+    try:
+        records_dict = get_night_records(date_dash_str)
+        with open(fout_json, "w") as json_out:
+            json_out.write(json.dumps(records_dict))
+        moth_logger.debug(f"Updated {fout_json} file")
+    except Exception:
+        moth_logger.exception(f"Failed to write {fout_json}")
+
+
+def backup_records_file(date_dash_str):
+    """ If cfg["RECORDS_BACKUP"] is set, write the night's records to
+        cfg['RECORDS_PATH']/day_count_YYYYMMDD.json in the background """
+    if cfg.get("RECORDS_BACKUP", False):
+        backup_executor.submit(_write_records_file, date_dash_str)
+
+
 def _get_file_update_time(fname: str) -> dt.datetime:
     """ helper function to the updated time of a file """
     udt = None
@@ -371,17 +592,11 @@ def get_db_update_time(use_db: bool = False) -> dt.datetime:
 
     if use_db:
         moth_logger.debug("Checking db for last update")
-        cnx = mariadb.connect(**sql_config)
-        cursor = cnx.cursor()
-        cursor.execute(
-            "SELECT update_time FROM information_schema.tables "
-            "WHERE TABLE_SCHEMA = 'cold_ash_moths' "
-            "AND table_name = 'moth_records';"
-        )
-        (update_time,) = cursor.fetchone()
-        moth_logger.debug(update_time)
-        cursor.close()
-        cnx.close()
+        with db_pool.connection() as cnx:
+            cursor = cnx.cursor()
+            update_time = storage.get_backend().update_time(cursor, "moth_records")
+            moth_logger.debug(update_time)
+            cursor.close()
 
     if not (update_time and use_db):
 
@@ -416,16 +631,10 @@ def get_moth_grid():
     cols = 5
 
     sql_species_name_by_month_year = f"""
-        SELECT tw.Year, tw.Month, tw.MothName
-            FROM (
-                SELECT year(Date) Year, month(Date) Month, MothName
-                    FROM moth_records
-                    WHERE MothName IS NOT NULL AND month(Date) = {current_month}
-                    GROUP BY Year, Month, MothName
-            ) tw
-        GROUP BY Year, Month, MothName;"""
+        SELECT Year, Month, MothName FROM {rollups.ROLLUP_TABLE}
+            WHERE Month = {current_month};"""
 
-    species_df = get_table(sql_species_name_by_month_year)
+    species_df = get_table(sql_species_name_by_month_year, dtypes=RECORD_DTYPES)
 
     state = {
         (True, True): "Seen",
@@ -464,6 +673,7 @@ def get_moth_grid():
     return css, "".join(cells)
 
 
+@graph_cache.cached(cfg["BY_MONTH_GRAPH"], "records")
 def generate_monthly_species(cursor=None):
     """ Called from
         /summary route
@@ -472,15 +682,8 @@ def generate_monthly_species(cursor=None):
 
     moth_logger.debug("Creating by monthly chart")
     pre_species_df = get_table(
-        """
-        SELECT tw.Year, tw.Month, tw.MothName
-        FROM (
-            SELECT year(Date) Year, month(Date) Month, MothName
-                FROM moth_records
-                WHERE MothName IS NOT NULL
-            GROUP BY Year, Month, MothName
-        ) tw
-        GROUP BY Year, Month, MothName;"""
+        f"SELECT Year, Month, MothName FROM {rollups.ROLLUP_TABLE};",
+        dtypes=RECORD_DTYPES,
     )
 
     if pre_species_df.empty:
@@ -494,174 +697,105 @@ def generate_monthly_species(cursor=None):
     by_month_df = by_month_df.reindex(range(1, 13), fill_value=0)
 
     # Find all species caught in a month regardless of year
-    gm = pre_species_df.groupby(["Month", "MothName"])
+    gm = pre_species_df.groupby(["Month", "MothName"], observed=True)
     by_all_df = gm.count().unstack("MothName").count(axis="columns")
 
     x_labels = [dt.date(2019, mn, 1).strftime("%b") for mn in range(1, 13)]
 
     # Create chart
-    fig = go.Figure()
-    fig.add_trace(go.Bar(x=x_labels, y=by_all_df, marker_color="#909090", name="All"))
+    traces = [plotly_json.bar(x_labels, by_all_df, "All", color="#909090")]
     if this_year in by_month_df.columns:
-        fig.add_trace(
-            go.Bar(
-                x=x_labels,
-                y=by_month_df[this_year],
-                width=0.5,
-                marker_color="blue",
-                name=this_year,
+        traces.append(
+            plotly_json.bar(
+                x_labels, by_month_df[this_year], this_year, color="blue", width=0.5
             )
         )
-    fig.update_layout(barmode="overlay")
-    fig.layout.legend.x = 0.99
-    fig.layout.legend.y = 0.98
-    fig.layout.legend.xanchor = "right"
-    fig.layout.width = 1000
-    fig.layout.height = 450
-    fig.update_xaxes(title=None)
-    fig.update_yaxes(title=None)
+    layout = dict(
+        barmode="overlay",
+        legend=dict(x=0.99, y=0.98, xanchor="right"),
+        width=1000,
+        height=450,
+        xaxis=dict(title={}),
+        yaxis=dict(title={}),
+    )
 
-    return fig.to_json()
+    return plotly_json.to_json(traces, layout)
 
 
+@graph_cache.cached(cfg["CUM_SPECIES_GRAPH"], "records")
 def generate_cummulative_species_graph(cursor=None):
     """ Called from get_summary """
     today = dt.date.today()
 
     # Update species graph
-    cum_species = get_table(
-        "SELECT year(Date) Year, Date, MothName "
-        "FROM moth_records WHERE MothName IS NOT NULL;"
-    )
-
-    cum_species["Catch"] = 1
-    cum_species["Date"] = cum_species["Date"].map(lambda dd: dd.replace(year=BASE_YEAR))
-    cum_species.set_index(["Year", "Date", "MothName"], inplace=True)
-
-    if cum_species.empty:
+    cum_results = species_curves.curves()  # Float, needed for the mask to work
+    if cum_results.empty:
         # If dataframe is empty...
         cum_results = pd.DataFrame(
             [0.0], index=pd.Index([today.year], name="Year"), columns=[str(today)]
         )
-    else:
-        try:
-            # The initial groupby is intended to remove duplicate indexes
-            cum_results = (
-                cum_species.groupby(["Year", "Date", "MothName"])
-                .sum()
-                .unstack("Date")
-                .fillna(method="ffill", axis=1)
-                .groupby(by="Year")
-                .count()
-                .Catch.astype(float)
-            )  # Needs to be float for mask to work
-        except ValueError:
-            # You've probably updated the taxonomy database and this has caused two
-            # entries on the same date to merge. This needs fixing/checking
-            dups_df = cum_species.groupby(["Year", "Date", "MothName"]).sum()
-            moth_logger.error(
-                "Finding a duplicate species - probably due to updated "
-                "taxonomy database merging species:"
-            )
-            moth_logger.error(dups_df.loc[dups_df.Catch > 1])
-            raise
 
     # Mask future dates to avoid plotting a horizontal line to eoy
     if today.year in cum_results.index:
-        cum_results.loc[today.year].mask(
-            cum_results.columns > str(today.replace(year=BASE_YEAR)),
-            other=np.NaN,
-            inplace=True,
-        )
+        cum_results.loc[
+            today.year, cum_results.columns > str(seasonal.base_date(today))
+        ] = np.nan
     # Generate cumulative species graph
     # Create chart
-    fig = cum_results.transpose().plot()
-    fig.update_layout(title="Cummulative Species")
-    fig.layout.legend.x = 0.01
-    fig.layout.legend.y = 0.98
-    fig.layout.legend.xanchor = "left"
-    fig.update_layout(line_layout)  # line_graph_theme
-    return fig.to_json()
+    season_df = cum_results.transpose()
+    layout = plotly_json.merge(
+        plotly_json.express_layout(season_df),
+        dict(
+            title={"text": "Cummulative Species"},
+            legend=dict(x=0.01, y=0.98, xanchor="left"),
+        ),
+        line_layout,  # line_graph_theme
+    )
+    return plotly_json.to_json(plotly_json.line_traces(season_df), layout)
 
 
+@graph_cache.cached("species", "records", "taxonomy")
 def graph_mothname_v3(mothname):
     """ Using plotly return the json data for a browser rendered graph
     """
 
-    catches_df = get_table(
-        f"""SELECT mr.Date, mr.MothCount
-        FROM (select * from {cfg['TAXONOMY_TABLE']} where MothName = "{mothname}") sp
-        JOIN {cfg['TAXONOMY_TABLE']} re
-        ON sp.TVK = re.TVK
-        JOIN moth_records mr
-        ON mr.MothName = re.MothName
-        GROUP BY mr.Date;"""
+    catches_df = get_named_records(
+        """SELECT Date, MothCount FROM moth_records
+        WHERE MothName IN ({names})
+        GROUP BY Date;""",
+        taxonomy_cache.get_taxonomy().synonyms(mothname),
+        dtypes={"Date": "datetime64[ns]"},
     )
 
     today = dt.date.today()
-    nyd = today.replace(month=1, day=1)
-    nye = today.replace(month=12, day=31)
-
-    date_year_index = pd.DatetimeIndex(
-        pd.date_range(
-            start=nyd.replace(year=BASE_YEAR), end=nye.replace(year=BASE_YEAR)
-        )
-    )
 
-    this_year_df = catches_df[catches_df["Date"] >= nyd]
-    this_year_df["Date"] = this_year_df["Date"].map(lambda e: e.replace(year=BASE_YEAR))
-    this_year_df = (
-        this_year_df.set_index("Date")
-        .reindex(date_year_index, fill_value=0)
-        .reset_index()
-    )
+    this_year = seasonal.year_of(catches_df["Date"]) >= today.year
+    catches_df["Date"] = seasonal.to_base_year(catches_df["Date"])
+    this_year_df = seasonal.reindex_season(catches_df[this_year].set_index("Date"))
 
-    catches_df["Date"] = catches_df["Date"].map(lambda e: e.replace(year=BASE_YEAR))
     flattened_df = catches_df.groupby("Date").mean()
-    all_catches_df = flattened_df.reindex(date_year_index, fill_value=0).reset_index()
+    all_catches_df = seasonal.reindex_season(flattened_df)
 
     # Render with plotly
-    fig = go.Figure()
-    fig.add_trace(
-        go.Scatter(
-            x=all_catches_df["index"],
-            y=all_catches_df.MothCount,
-            mode="lines",
-            name="Average",
-        )
-    )
-    fig.add_trace(
-        go.Scatter(
-            x=this_year_df["index"],
-            y=this_year_df.MothCount,
-            mode="lines",
-            name=f"{today.year}",
-        )
-    )
-    fig.add_shape(
-        # Line Vertical
+    traces = [
+        plotly_json.scatter(all_catches_df.index, all_catches_df.MothCount, "Average"),
+        plotly_json.scatter(this_year_df.index, this_year_df.MothCount, today.year),
+    ]
+    layout = plotly_json.merge(
         dict(
-            type="line",
-            x0=today.replace(year=BASE_YEAR),
-            y0=0,
-            x1=today.replace(year=BASE_YEAR),
-            y1=1,
-            yref="paper",
-            line=dict(color="Black", width=3, dash="dot"),
-        )
+            shapes=[plotly_json.today_marker(seasonal.base_date(today))],
+            title={"text": mothname},
+            legend=dict(x=0.99, y=0.98, xanchor="right"),
+        ),
+        line_layout,
     )
 
-    fig.layout.title = mothname
-    fig.layout.legend.x = 0.99
-    fig.layout.legend.y = 0.98
-    fig.layout.legend.xanchor = "right"
-    fig.update_layout(line_layout)
-
-    return fig.to_json()
+    return plotly_json.to_json(traces, layout)
 
 
 app = Bottle()
 app.install(log_to_logger)  # Logs html requests to a file
+app.install(compress.compress_response)  # gzip/brotli if the browser accepts it
 
 
 @app.route("/graphs/<species>")
@@ -700,221 +834,152 @@ def get_used_names(map_tvk2mn, tvk):
     return common_name, scientific_name
 
 
-def get_genus_list():
-    """ Show list of moths caught to date. """
+def get_year_totals():
+    """ DataFrame of Year, MothName, Total - the number caught each year """
+    return get_table(
+        f"""SELECT Year, MothName, SUM(Total) Total FROM {rollups.ROLLUP_TABLE}
+            GROUP BY Year, MothName;""",
+        dtypes={"Year": "int16", "Total": "float64"},
+    )
+
+
+def annual_average(year_totals, name_map):
+    """ The average catch per year, rounded up, of the names in year_totals grouped
+        by name_map (a dict of MothName to e.g. TVK or genus), highest first."""
+    group = year_totals.MothName.map(name_map).rename("Group")
+    return (
+        year_totals.groupby([year_totals.Year, group])["Total"]
+        .sum()
+        .groupby("Group")
+        .mean()
+        .sort_values(ascending=False)
+        .apply(np.ceil)
+        .astype(int)
+    )
+
 
-    sql_string = f"""
-    SELECT MothGenus Genus, ceil(avg(Count)) `Annual Average` FROM
-    (
-        SELECT year(Date) Year,  MothGenus,  sum(MothCount) Count
-            FROM moth_records INNER JOIN {cfg["TAXONOMY_TABLE"]}
-                ON moth_records.MothName = {cfg["TAXONOMY_TABLE"]}.MothName
-            GROUP BY Year, MothGenus
-    ) gc
-    GROUP BY Genus ORDER BY `Annual Average` DESC;"""
+def get_rank_list(rank):
+    """ Show list of the family, subfamily or genus of moths caught to date. """
 
-    sql_df = get_table(sql_string)
+    heading = rank.capitalize()
+    taxonomy = taxonomy_cache.get_taxonomy()
+    sql_df = (
+        annual_average(get_year_totals(), taxonomy.rank_map(rank))
+        .rename("Annual Average")
+        .rename_axis(heading)
+        .reset_index()
+    )
 
     # Add links
-    sql_df["Genus"] = sql_df["Genus"].map(
-        lambda s: f'<a href="/genus/{s}">{s}</a>', na_action="ignore"
+    sql_df[heading] = sql_df[heading].map(
+        lambda s: f'<a href="/{rank}/{s}">{s}</a>', na_action="ignore"
     )
 
     return template(
         "species_summary.tpl",
-        title="Genus Summary",
+        title=f"{heading} Summary",
         species_table=sql_df.to_html(escape=False, index=False, justify="left"),
     )
 
 
-def get_family_list():
-    """ Show list of moths caught to date. """
+@graph_cache.cached("taxon", "records", "taxonomy")
+def graph_rank(rank, taxon):
+    """ Plotly json for the mean and this year's daily count of a family, subfamily
+        or genus, None if it has never been recorded. """
 
-    sql_string = f"""
-    SELECT MothFamily Family, ceil(avg(Count)) `Annual Average` FROM
-    (
-        SELECT year(Date) Year,  MothFamily,  sum(MothCount) Count
-            FROM moth_records INNER JOIN {cfg["TAXONOMY_TABLE"]}
-                ON moth_records.MothName = {cfg["TAXONOMY_TABLE"]}.MothName
-            GROUP BY Year, MothFamily
-    ) gc
-    GROUP BY Family ORDER BY `Annual Average` DESC;"""
+    table_df = taxon_rank.taxon_ranks.season_table(rank, taxon)
+    if table_df.empty:
+        return None
 
-    sql_df = get_table(sql_string)
+    today = dt.date.today()
+    legend = ["Mean"]
+    if today.year in table_df.columns:
+        legend += [today.year]
 
-    # Add links
-    sql_df["Family"] = sql_df["Family"].map(
-        lambda s: f'<a href="/family/{s}">{s}</a>', na_action="ignore"
+    season_df = table_df[legend]
+    layout = plotly_json.merge(
+        plotly_json.express_layout(season_df),
+        dict(
+            shapes=[plotly_json.today_marker(seasonal.base_date(today))],
+            xaxis=dict(
+                ticklabelmode="period",
+                dtick="M1",
+                tickformat="%b",
+                range=[f"{BASE_YEAR}-01-01", f"{BASE_YEAR}-12-31"],
+            ),
+            title={"text": taxon},
+        ),
+        line_layout,
     )
+    return plotly_json.to_json(plotly_json.line_traces(season_df), layout)
+
+
+def get_rank_summary(rank, taxon):
+    """ Show the species in a given family, subfamily or genus and graph the
+        aggregation. """
+
+    graph_json = graph_rank(rank, taxon)
+    if graph_json is None:
+        return template("no_records.tpl")
 
     return template(
-        "species_summary.tpl",
-        title="Family Summary",
-        species_table=sql_df.to_html(escape=False, index=False, justify="left"),
+        "taxon_summary.tpl",
+        taxon=taxon,
+        species=taxon_rank.taxon_ranks.names(rank, taxon),
+        graph=graph_json,
     )
 
 
 @app.route("/genus")
 @app.route("/genus/<genus>")
+@http_cache.conditional("records", "taxonomy", by_date=True)
 def get_genus(genus=None):
     """ Show the species in a given genus and graph the aggregation.
         If genus is None then present and ordered list of genus by
         average moth count"""
 
     if genus is None:
-        return get_genus_list()
-
-    sql_string = (
-        f"""
-            SELECT Date, moth_records.MothName, MothGenus, sum(MothCount) MothCount
-            FROM moth_records INNER JOIN {cfg["TAXONOMY_TABLE"]}
-                ON moth_records.MothName = {cfg["TAXONOMY_TABLE"]}.MothName
-            WHERE MothGenus LIKE """
-        + f'"{genus}" GROUP BY Date;'
-    )
-
-    catches_df = get_table(sql_string)
-    if catches_df.empty:
-        return template("no_records.tpl")
-
-    today = dt.date.today()
-    this_year = today.year
-    date_year_index = pd.DatetimeIndex(
-        pd.date_range(
-            start=today.replace(year=BASE_YEAR, month=1, day=1),
-            end=today.replace(year=BASE_YEAR, month=12, day=31),
-        )
-    )
+        return get_rank_list("genus")
+    return get_rank_summary("genus", genus)
 
-    # Need to average by date
-    catches_df["Year"] = catches_df.Date.apply(lambda d: d.timetuple().tm_year)
-    catches_df["Date"] = catches_df.Date.apply(lambda d: d.replace(year=BASE_YEAR))
 
-    legend = ["Mean"]
-    if this_year in catches_df.Year.unique():
-        legend += [this_year]
-
-    table_df = (
-        catches_df.drop(["MothName", "MothGenus"], "columns")
-        .set_index(["Year", "Date"])
-        .unstack("Year")
-        .fillna(0)["MothCount"]
-        .astype(float)
-    )
-
-    table_df["Mean"] = table_df.mean(axis="columns")
-    fig = table_df.reindex(date_year_index).fillna(0)[legend].plot()
-    fig.add_shape(
-        # Line Vertical
-        dict(
-            type="line",
-            x0=today.replace(year=BASE_YEAR),
-            y0=0,
-            x1=today.replace(year=BASE_YEAR),
-            y1=1,
-            yref="paper",
-            line=dict(color="Black", width=3, dash="dot"),
-        )
-    )
-    fig.update_xaxes(
-        ticklabelmode="period",
-        dtick="M1",
-        tickformat="%b",
-        range=[f"{BASE_YEAR}-01-01", f"{BASE_YEAR}-12-31"],
-    )
-    fig.layout.title = genus
-    fig.update_layout(line_layout)
+@app.route("/subfamily")
+@app.route("/subfamily/<subfamily>")
+@http_cache.conditional("records", "taxonomy", by_date=True)
+def get_subfamily(subfamily=None):
+    """ Show the species in a given subfamily and graph the aggregation.
+        If subfamily is None then present and ordered list of subfamily by
+        average moth count"""
 
-    return template(
-        "genus_summary.tpl",
-        genus=genus,
-        species=catches_df.MothName.unique(),
-        gg=fig.to_json(),
-    )
+    if subfamily is None:
+        return get_rank_list("subfamily")
+    return get_rank_summary("subfamily", subfamily)
 
 
 @app.route("/family")
 @app.route("/family/<family>")
+@http_cache.conditional("records", "taxonomy", by_date=True)
 def get_family(family=None):
     """ Show the species in a given family and graph the aggregation. """
 
     if family is None:
-        return get_family_list()
-
-    sql_string = (
-        f"""
-        SELECT Date, moth_records.MothName, MothFamily, sum(MothCount) MothCount
-        FROM moth_records INNER JOIN {cfg["TAXONOMY_TABLE"]}
-            ON moth_records.MothName = {cfg["TAXONOMY_TABLE"]}.MothName
-        WHERE MothFamily LIKE """
-        + f'"{family}" GROUP BY Date;'
-    )
-
-    catches_df = get_table(sql_string)
-    if catches_df.empty:
-        return template("no_records.tpl")
+        return get_rank_list("family")
+    return get_rank_summary("family", family)
 
-    today = dt.date.today()
-    this_year = today.year
-    date_year_index = pd.DatetimeIndex(
-        pd.date_range(
-            start=today.replace(year=BASE_YEAR, month=1, day=1),
-            end=today.replace(year=BASE_YEAR, month=12, day=31),
-        )
-    )
-
-    # Need to average by date
-    catches_df["Year"] = catches_df.Date.apply(lambda d: d.timetuple().tm_year)
-    catches_df["Date"] = catches_df.Date.apply(lambda d: d.replace(year=BASE_YEAR))
-
-    legend = ["Mean"]
-    if this_year in catches_df.Year.unique():
-        legend += [this_year]
-
-    table_df = (
-        catches_df.drop(["MothName", "MothFamily"], "columns")
-        .set_index(["Year", "Date"])
-        .unstack("Year")
-        .fillna(0)["MothCount"]
-        .astype(float)
-    )
 
-    table_df["Mean"] = table_df.mean(axis="columns")
-    fig = table_df.reindex(date_year_index).fillna(0)[legend].plot()
-    fig.add_shape(
-        # Line Vertical
-        dict(
-            type="line",
-            x0=today.replace(year=BASE_YEAR),
-            y0=0,
-            x1=today.replace(year=BASE_YEAR),
-            y1=1,
-            yref="paper",
-            line=dict(color="Black", width=3, dash="dot"),
-        )
-    )
-    fig.update_xaxes(
-        ticklabelmode="period",
-        dtick="M1",
-        tickformat="%b",
-        range=[f"{BASE_YEAR}-01-01", f"{BASE_YEAR}-12-31"],
-    )
-    fig.layout.title = family
-    fig.update_layout(line_layout)
+@lru_cache(maxsize=1)
+def intro_html():
+    """ This module's docstring as html, for the landing page """
+    from markdown import markdown  # Only needed here
 
-    return template(
-        "family_summary.tpl",
-        family=family,
-        species=catches_df.MothName.unique(),
-        fg=fig.to_json(),
-    )
+    return markdown(__doc__)
 
 
 @app.route("/")
 def index():
     """ Landing page for the web site. """
     # Display a landing page
-    return template("index.tpl", intro=markdown(__doc__))
+    return template("index.tpl", intro=intro_html())
 
 
 @app.route("/static/<filename>")
@@ -928,6 +993,108 @@ def service_static_file(filename):
     return rsp
 
 
+# Worker threads used to run the survey sheet queries side by side
+survey_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="survey")
+
+
+@route_cache.cached(
+    maxsize=8, tags=lambda dash_date_str: [("date", dash_date_str)], by_date=False
+)
+def _survey_records(dash_date_str):
+    """ The records for a date as the list of dicts used by the survey sheet. """
+
+    records = get_night_records(dash_date_str)
+
+    # records is a dict whose keys have been managled " " replaced with "_"
+    return [
+        {
+            "species": k.replace("_", " "),
+            "count": int(v["count"]),
+            "recent": 0,
+            "location": v["location"],
+            "recorder": v["recorder"],
+            "trap": v["trap"],
+            "version": record_version(
+                (int(v["count"]), v["location"], v["recorder"], v["trap"])
+            ),
+        }
+        for k, v in records.items()
+    ]
+
+
+def survey_conflicts(dash_date_str):
+    """ The conflicts (see _merge_night) of the submission for dash_date_str saved
+        last, so those of a queued submission are shown when the sheet is next
+        opened, until a later submission for the night is saved. """
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            f"SELECT Conflicts FROM {APPLIED_TABLE} WHERE Date = %s "
+            "ORDER BY Submitted DESC LIMIT 1;",
+            (dash_date_str,),
+        )
+        row = cursor.fetchone()
+        cursor.close()
+    return json.loads(row[0]) if row and row[0] else []
+
+
+def load_survey_sheet(dash_date_str, conflicts=None):
+    """ Collect everything the survey sheet for dash_date_str needs.
+
+        The stages are independent queries so they run concurrently, each on its own
+        pooled connection. Returns the keyword arguments for vue_survey.tpl, and logs
+        how long each stage took. conflicts are the species of a submission that
+        couldn't be saved, shown on the sheet, by default those still unresolved
+        from the last submission saved (see survey_conflicts).
+    """
+
+    def timed(stage, fn, *args):
+        stage_start = time.time()
+        rv = fn(*args)
+        return stage, rv, time.time() - stage_start
+
+    stages = {
+        # The possible catches, used by the template to populate the survey sheet
+        "manifest": (manifests.get, dash_date_str),
+        "records": (_survey_records, dash_date_str),
+        # Column defaults and option lists - usually already cached
+        "options": (schema_cache.options_cache.get,),
+    }
+    if conflicts is None:
+        stages["conflicts"] = (survey_conflicts, dash_date_str)
+
+    start = time.time()
+    futures = [
+        survey_executor.submit(timed, stage, *job) for stage, job in stages.items()
+    ]
+    results = {}
+    timings = []
+    for future in futures:
+        stage, rv, duration = future.result()
+        results[stage] = rv
+        timings.append(f"{stage} {duration:.3f}s")
+    moth_logger.debug(
+        f"Survey sheet {dash_date_str} loaded in {time.time() - start:.3f}s "
+        f"({', '.join(timings)})"
+    )
+    moth_logger.debug(f"Recent moths:{str(results['records'])}")
+
+    options = results["options"]
+    defaults = options["defaults"]
+    return {
+        "records": json.dumps(results["records"]),
+        "manifest": json.dumps(results["manifest"]),
+        "conflicts": json.dumps(list(results.get("conflicts", conflicts))),
+        "dash_date_str": dash_date_str,
+        "default_location": defaults.get("Location"),
+        "location_list": options["Location"]["Name"].to_list(),
+        "default_trap": defaults.get("Trap"),
+        "trap_list": options["Trap"]["Trap"].to_list(),
+        "default_recorder": defaults.get("Recorder"),
+        "recorder_list": options["Recorder"]["Recorder"].to_list(),
+    }
+
+
 @app.route("/last_survey")
 def last_survey():
     """ Identifies the most recent record, and jumps to that survey sheet. """
@@ -957,55 +1124,20 @@ def serve_survey2(dash_date_str=None):
         # Create today's dash_date_str
         dash_date_str = dt.date.today().strftime("%Y-%m-%d")
 
-    # generate day_count_YYYYMMDD.json file to later recover the records.
-    generate_records_file(None, dash_date_str)
-
-    # This creates a manifest file which shows possible catches.
-    # The template uses this to populate the survey sheet.
-    # We could just pass this data to the template.
-    refresh_manifest(dash_date_str)
-
-    try:
-        date_str = dash_date_str.replace("-", "")
-        with open(f"{cfg['RECORDS_PATH']}day_count_{date_str}.json") as json_in:
-            records = json.load(json_in)
-            # records is a dict whose keys have been managled " " replaced with "_"
-            unmangled_records = [
-                {
-                    "species": k.replace("_", " "),
-                    "count": int(v["count"]),
-                    "recent": 0,
-                    "location": v["location"],
-                    "recorder": v["recorder"],
-                    "trap": v["trap"],
-                }
-                for k, v in records.items()
-            ]
-    #    except FileNotFoundError:
-    except IndexError:
-        unmangled_records = []
+    survey_data = load_survey_sheet(dash_date_str)
+    return template("vue_survey.tpl", **survey_data)
 
-    moth_logger.debug(f"Recent moths:{str(unmangled_records)}")
 
-    recorder_list = get_table("SELECT * from recorders_list;")["Recorder"].to_list()
-    trap_list = get_table("SELECT * from traps_list;")["Trap"].to_list()
-    location_list = get_table("SELECT Name from locations_list;")["Name"].to_list()
-
-    return template(
-        "vue_survey.tpl",
-        records=json.dumps(unmangled_records),
-        dash_date_str=dash_date_str,
-        default_location=update_moth_taxonomy.get_column_default("Location"),
-        location_list=location_list,
-        default_trap=update_moth_taxonomy.get_column_default("Trap"),
-        trap_list=trap_list,
-        default_recorder=update_moth_taxonomy.get_column_default("Recorder"),
-        recorder_list=recorder_list,
-    )
+@app.route("/manifest/<dash_date_str:re:\\d{4}-\\d{2}-\\d{2}>")
+@http_cache.conditional("records")
+def get_manifest(dash_date_str):
+    """ The survey sheet manifest for a date: the species likely to be caught. """
+    return {"date": dash_date_str, "species": manifests.get(dash_date_str)}
 
 
 @app.route("/summary")
-@lru_cache(maxsize=3)
+@http_cache.conditional("records", by_date=True)
+@route_cache.cached(maxsize=3)
 def get_summary():
     """ Display an overall summary for the Moths web-site. """
 
@@ -1031,34 +1163,49 @@ def update_mothnames():
     update_moth_taxonomy.update_mothnames()
 
 
-@app.route("/species")
-def species():
-    """ Show  list of moths caught to date. """
+@app.post("/rebuild_rollups")
+def rebuild_rollups():
+    """ Recompute the monthly totals used by the summary and species pages.
+        A POST, so crawlers and the page warmer can't set it off. """
+    rollups.rebuild()
+    route_cache.invalidate([("records",)])
+    return "Rollups rebuilt"
+
+
+def species_table():
+    """ DataFrame of the Species (common names), Taxon (scientific name) and
+        Annual Avg. of every species caught, most caught first """
+    taxonomy = taxonomy_cache.get_taxonomy()
+
     # Get Avg catch per year by TVK
-    avg_per_year = get_table(
-        f"""
-            SELECT TVK, ceil(avg(Total)) "Annual Average"
-                FROM (
-                    SELECT Year(Date) Year, MothName, TVK,
-                    Sum(MothCount) Total, MothGenus, MothSpecies
-                        FROM
-                        (moth_records JOIN {cfg["TAXONOMY_TABLE"]} USING (MothName))
-                        GROUP BY Year, TVK
-                ) yt GROUP BY TVK ORDER BY avg(Total) DESC
-                ;"""
+    year_totals = get_year_totals()
+    avg_per_year = (
+        annual_average(year_totals, taxonomy.name_to_tvk)
+        .rename("Annual Average")
+        .rename_axis("TVK")
+        .reset_index()
     )
 
-    # Get a map of all MothNames to TVK
+    # Get a map of all recorded MothNames to TVK
     map_tvk2m = (
-        get_table(
-            f"""SELECT MothName, TVK, MothGenus, MothSpecies FROM moth_records JOIN
-                {cfg["TAXONOMY_TABLE"]} USING (MothName) GROUP BY MothName;"""
+        pd.DataFrame(
+            [
+                [
+                    name,
+                    taxonomy.tvk(name),
+                    taxonomy.rank_of(name, "genus"),
+                    taxonomy.rank_of(name, "species"),
+                ]
+                for name in sorted(year_totals.MothName.unique())
+                if taxonomy.tvk(name)
+            ],
+            columns=["MothName", "TVK", "MothGenus", "MothSpecies"],
         )
         .set_index("TVK")
         .sort_index()
     )
 
-    sql_df = pd.DataFrame(
+    return pd.DataFrame(
         [
             [*get_used_names(map_tvk2m, tvk), int(avg)]
             for tvk, avg in zip(avg_per_year.TVK, avg_per_year["Annual Average"])
@@ -1066,6 +1213,14 @@ def species():
         columns=["Species", "Taxon", "Annual Avg."],
     )
 
+
+@app.route("/species")
+@http_cache.conditional("records", "taxonomy")
+@route_cache.cached(maxsize=1, by_date=False)
+def species():
+    """ Show  list of moths caught to date. """
+    sql_df = species_table()
+
     # Add links
     sql_df["Species"] = sql_df["Species"].map(
         lambda s: f'<a href="/species/{s}">{s}</a>', na_action="ignore"
@@ -1081,35 +1236,40 @@ def species():
     )
 
 
+def species_tags(species):
+    """ route_cache tags for the species page of species """
+    species = species.replace("%20", " ")
+    return [("tvk", taxonomy_cache.get_taxonomy().tvk(species) or species)]
+
+
 @app.route("/species/<species:path>")
-@lru_cache(maxsize=16)
+@http_cache.conditional("records", "taxonomy", by_date=True)
+@route_cache.cached(maxsize=16, tags=species_tags)
 def get_pspecies(species):
     """ Generate a summary page for the specified moth species.
         Use % as a wildcard."""
 
     species = species.replace("%20", " ")
-    query_str = f"""SELECT mr.Date, re.MothName, mr.MothCount, re.TVK
-        FROM (select * from {cfg['TAXONOMY_TABLE']} where MothName = "{species}") sp
-        JOIN {cfg['TAXONOMY_TABLE']} re
-            ON sp.TVK = re.TVK
-        JOIN moth_records mr
-            ON mr.MothName = re.MothName
-        ORDER BY mr.Date;"""
-    all_survey_df = get_table(query_str)
+    taxonomy = taxonomy_cache.get_taxonomy()
+    all_survey_df = get_named_records(
+        """SELECT Date, MothName, MothCount FROM moth_records
+            WHERE MothName IN ({names})
+            ORDER BY Date;""",
+        taxonomy.synonyms(species),
+    )
+    all_survey_df["TVK"] = taxonomy.tvk(species)
 
     unique_species = all_survey_df["TVK"].unique()
     if len(unique_species) == 1:
-        t = get_table(
-            f"""SELECT * from {cfg["TAXONOMY_TABLE"]}
-                WHERE MothName like "{species}";"""
-        ).iloc[0]
+        t = taxonomy.ranks(species)
         taxo_str = (
             f'<ul style="list-style-type: none;">'
-            f'<li><a href="/family/{t.MothFamily}">{t.MothFamily}</a></li>'
-            f'<ul style="list-style-type: none;"><li>&#9492;{t.MothSubFamily}</li>'
+            f'<li><a href="/family/{t["family"]}">{t["family"]}</a></li>'
+            f'<ul style="list-style-type: none;"><li>&#9492;'
+            f'<a href="/subfamily/{t["subfamily"]}">{t["subfamily"]}</a></li>'
             f'<ul style="list-style-type: none;">'
-            f'<li>&#9492;<a href="/genus/{t.MothGenus}">{t.MothGenus}</a></li>'
-            f'<ul style="list-style-type: none;"><li>&#9492;{t.MothSpecies}</li>'
+            f'<li>&#9492;<a href="/genus/{t["genus"]}">{t["genus"]}</a></li>'
+            f'<ul style="list-style-type: none;"><li>&#9492;{t["species"]}</li>'
             f"</ul></ul></ul></ul>"
         )
 
@@ -1135,31 +1295,34 @@ def get_pspecies(species):
 
 
 @app.route("/latest")
+@http_cache.conditional("records", "taxonomy", by_date=True)
 def show_latest():
     """ Table showing the latest moths - need to consider options
         e.g. location (allow multiple selections)
     """
 
+    taxonomy = taxonomy_cache.get_taxonomy()
+
     # Get the records for last 14 dates trapped
     recent_df = get_table(
-        """SELECT mr.Date, mr.MothName, mr.MothCount, TVK FROM moth_records mr
-            JOIN irecord_taxonomy USING (MothName)
+        """SELECT mr.Date, mr.MothName, mr.MothCount FROM moth_records mr
             JOIN (SELECT Date from moth_records
             GROUP BY Date
             ORDER BY Date DESC LIMIT 14) dates
             USING (Date) ORDER BY Date;"""
     )
+    recent_df["TVK"] = recent_df.MothName.map(taxonomy.name_to_tvk)
+    recent_df = recent_df.dropna(subset=["TVK"])
 
     earliest_table_date = min(recent_df.Date)
 
     seen_before = get_table(
-        f"""SELECT MothName, YEAR(Max(Date)) Year, TVK FROM
-                (SELECT * FROM moth_records WHERE
-                    Date < Date("{earliest_table_date}") ) mr
-                JOIN
-                {cfg["TAXONOMY_TABLE"]} USING (MothName)
+        f"""SELECT MothName, YEAR(Max(Date)) Year FROM moth_records
+                WHERE Date < Date("{earliest_table_date}")
         GROUP BY MothName;"""
     )
+    seen_before["TVK"] = seen_before.MothName.map(taxonomy.name_to_tvk)
+    seen_before = seen_before.dropna(subset=["TVK"])
 
     not_nft_tvk = seen_before.TVK.to_list()
     not_ffy_tvk = seen_before[seen_before.Year == dt.date.today().year].TVK.to_list()
@@ -1188,6 +1351,14 @@ def show_latest():
     )
 
 
+def survey_tags(date_string, names):
+    """ route_cache tags for a change to the records of names on date_string """
+    taxonomy = taxonomy_cache.get_taxonomy()
+    tags = [("records",), ("date", date_string), ("year", int(date_string[0:4]))]
+    tags += [("tvk", taxonomy.tvk(name) or name) for name in names if name]
+    return tags
+
+
 @app.post("/handle_survey")
 def survey_handler():
     """ Handler to manage the data returned from the survey sheet. """
@@ -1197,9 +1368,10 @@ def survey_handler():
     default_trap = request.forms.get("option_Trap") or "NULL"
     default_location = request.forms.get("option_Location") or "NULL"
 
-    fout_json = (
-        cfg["RECORDS_PATH"] + "day_count_" + date_string.replace("-", "") + ".json"
-    )
+    # Sheets sending "merge" are merged per species with any saved since they
+    # loaded, older ones replace the night
+    merge = "merge" in request.forms
+    based_on = {}
 
     results_dict = {}
     for moth in request.forms.keys():
@@ -1208,52 +1380,152 @@ def survey_handler():
             "option_Recorder",
             "option_Location",
             "option_Trap",
+            "merge",
         ]:
             continue
         specimens = json.loads((request.forms.get(moth)))
         if not isinstance(specimens["count"], int):
             continue
+        based_on[moth.replace("_", " ")] = specimens.get("version", "")
         if specimens["count"] <= 0:
             continue
 
         specimens["recorder"] = specimens["recorder"] or default_recorder
         specimens["trap"] = specimens["trap"] or default_trap
         specimens["location"] = specimens["location"] or default_location
-        results_dict[moth] = specimens
-
-    # Store results locally  so when survey sheet is recalled it will auto populate
-    # This probably isn't really required as we can access the SQL quickly
-    with open(fout_json, "w") as fout_js:
-        moth_logger.debug(f"Updating {fout_json} file")
-        moth_logger.debug(results_dict)
-        fout_js.write(json.dumps(results_dict))
-
-    # Get a connection to the databe
-    cnx = mariadb.connect(**sql_config)
-    cursor = cnx.cursor()
-    update_moth_database(cursor, date_string, results_dict)
-    cnx.close()
-
-    # Clear species cache
-    get_pspecies.cache_clear()
-    get_summary.cache_clear()
-
-    # If the date string is today-return recent catches page,
-    # otherwise show data entry for the next day
-    page_date = dt.datetime.strptime(date_string, "%Y-%m-%d")
-    if page_date.date() == dt.date.today():
-        rsp = show_latest()
-    else:
-        rsp = serve_survey2((page_date + dt.timedelta(days=1)).strftime("%Y-%m-%d"))
+        results_dict[moth] = {field: specimens[field] for field in RECORD_FIELDS}
+
+    moth_logger.debug(results_dict)
+
+    # Refuse records the database wouldn't take, before journalling them, so the
+    # sheet (still in the browser) can be corrected and sent again
+    problems = [
+        record_problem(moth.replace("_", " "), record)
+        for moth, record in results_dict.items()
+    ]
+    problems = [problem for problem in problems if problem]
+    if problems:
+        moth_logger.warning(f"Survey {date_string} refused: {problems}")
+        response.status = 400
+        return template(
+            "survey_rejected.tpl", dash_date_str=date_string, problems=problems
+        )
+
+    # Journal the survey, then give the worker a moment to save it to the database
+    survey_journal = get_survey_journal()
+    entry_id = survey_journal.append(
+        {
+            "date": date_string,
+            "records": results_dict,
+            "based_on": based_on if merge else None,
+        }
+    )
+    saved, conflicts = survey_journal.wait(entry_id, cfg.get("JOURNAL_WAIT", 2.0))
+
     # Set the a cookie "delete_cache_date" to remove local stored data which would
     # overwrite data if edited on another machine. So we want to delete this
     # data on a successful submission. The tpl files must handle this and clear
     # the cookie. This won't handle stale data on one machine from overwriting update
     # but that is an unlikely edge case.
     response.set_header("set-cookie", f"delete_cache_date={date_string}")
+    if not saved:
+        # The database is slow or down, the survey is safe in the journal
+        response.status = 202
+        return template("survey_queued.tpl", dash_date_str=date_string)
+
+    # If species couldn't be saved, show the night again as now stored, listing them.
+    # Otherwise if the date string is today-return recent catches page,
+    # otherwise show data entry for the next day
+    page_date = dt.datetime.strptime(date_string, "%Y-%m-%d")
+    if conflicts:
+        response.status = 409
+        rsp = template("vue_survey.tpl", **load_survey_sheet(date_string, conflicts))
+    elif page_date.date() == dt.date.today():
+        rsp = show_latest()
+    else:
+        rsp = serve_survey2((page_date + dt.timedelta(days=1)).strftime("%Y-%m-%d"))
     return rsp
 
 
+def save_survey(entry):
+    """ Save a journalled survey submission to the database, and clear the cached
+        pages it changes. Returns the species in conflict (see _merge_night). """
+    date_string = entry["date"]
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        touched, changed_names, conflicts = update_moth_database(
+            cnx,
+            cursor,
+            date_string,
+            entry["records"],
+            entry["based_on"],
+            entry.get("id"),
+            entry.get("time"),
+        )
+        cursor.close()
+    moth_logger.info(f"Survey {date_string} saved: {touched}")
+    if conflicts:
+        moth_logger.warning(f"Survey {date_string} conflicts: {conflicts}")
+    species_curves.refresh_year(int(date_string[0:4]))
+
+    # Clear the cached pages showing this date's records
+    route_cache.invalidate(survey_tags(date_string, changed_names))
+    manifests.invalidate(date_string)
+    backup_records_file(date_string)
+    return conflicts
+
+
+def warm_top_species():
+    """ Queue the pages of the WARM_SPECIES most caught species, as linked to from
+        the species list """
+    top_df = species_table().head(cfg.get("WARM_SPECIES", 10))
+    for common_name, scientific_name in zip(top_df.Species, top_df.Taxon):
+        if common_name and "," not in common_name:
+            name = common_name
+        else:
+            name = scientific_name
+        warmup.warmer.submit(
+            f"species/{name}", get_pspecies.__wrapped__, species=name
+        )
+
+
+def warm_pages():
+    """ Queue the summary, species list and most popular species pages to be built
+        in the background, ready for the next visitor """
+    warmup.warmer.submit("summary", get_summary.__wrapped__)
+    warmup.warmer.submit("species", species.__wrapped__)
+    warmup.warmer.submit("top species", warm_top_species)
+
+
+def _transient_error(error):
+    """ True for the errors of the database being down or busy, which the journal
+        retries for as long as they last """
+    return isinstance(
+        error, (db_pool.PoolTimeout, OSError)
+    ) or storage.get_backend().is_transient(error)
+
+
+_survey_journal = None
+_survey_journal_lock = threading.Lock()
+
+
+def get_survey_journal():
+    """ The journal of survey submissions, saved by a worker thread after each batch
+        of which the popular pages are rebuilt. Opened on first use, as opening it
+        replays and rewrites the journal file, which importing this module (e.g. by
+        the reloader's parent process, or the tests) mustn't. """
+    global _survey_journal
+    with _survey_journal_lock:
+        if _survey_journal is None:
+            _survey_journal = journal.SurveyJournal(
+                cfg["RECORDS_PATH"] + cfg.get("JOURNAL_FILE", "survey_journal.jsonl"),
+                apply=save_survey,
+                after_batch=lambda entries: warm_pages(),
+                is_transient=_transient_error,
+            )
+    return _survey_journal
+
+
 @app.route("/debug")
 def debug_info():
     """ Route showing some debug.
@@ -1261,26 +1533,58 @@ def debug_info():
     return [str(route.__dict__) + "</p>" for route in app.routes]
 
 
+@app.route("/status")
+def server_status():
+    """ Returns JSON with server statistics for monitoring. """
+    return {
+        "pool": db_pool.pool_stats(),
+        "graph_cache": graph_cache.get_graphs().stats(),
+        "route_cache": route_cache.stats(),
+        "compression": compress.compressed_bodies.stats(),
+        "startup": startup.timings,
+        "warmup": warmup.warmer.stats(),
+        "manifest": manifests.stats(),
+        "journal": get_survey_journal().stats(),
+    }
+
+
 @app.route("/download/<dl_year>")
 @app.route("/download/<dl_year>/<dl_month>")
+@route_cache.cached(
+    maxsize=8,
+    tags=lambda dl_year, dl_month=None: [("year", int(dl_year)), ("options",)],
+    by_date=False,
+)
 def export_data(dl_year, dl_month=None):
     """ This function generate the csv to be exported in a format
         compatible with iRecord https://www.brc.ac.uk/irecord/import-records
     """
 
+    taxonomy = taxonomy_cache.get_taxonomy()
     month_option = f" AND Month(Date)={dl_month}" if dl_month else ""
-    query_string = f"""SELECT mr.Date, CONCAT(mt.MothGenus, " ", mt.MothSpecies) Species,
+    query_string = f"""SELECT mr.Date, mr.MothName,
         mr.MothCount Quantity, ll.OSGB_Grid GridRef, mr.Recorder "Recorder Name",
-        mr.Location "Site name",
-        CONCAT("Lamp Trap: ", mr.Trap, "\nCommon Name: ", mt.MothName) Comment
+        mr.Location "Site name", mr.Trap
         FROM (select * FROM moth_records WHERE Year(Date)={dl_year} {month_option}) mr
-        JOIN (SELECT * FROM {cfg["TAXONOMY_TABLE"]}) mt ON mr.MothName=mt.MothName
         JOIN (SELECT * FROM locations_list) ll ON ll.Name=mr.Location;"""
 
     moth_logger.debug(query_string)
-    export_data = get_table(query_string)
-    export_data["Stage"] = "Adult"  # Currently we only survey by adults
-    return template(export_data.loc[export_data["Quantity"] != 0].to_csv(index=False))
+    export_csv = ""
+    for export_data in iter_table(query_string):
+        names = export_data.pop("MothName").astype(object)
+        export_data.insert(
+            1, "Species", names.map(taxonomy.scientific_name, na_action="ignore")
+        )
+        export_data["Comment"] = (
+            "Lamp Trap: " + export_data.pop("Trap") + "\nCommon Name: " + names
+        )
+        export_data["Stage"] = "Adult"  # Currently we only survey by adults
+        export_data = export_data[names.isin(taxonomy.name_to_tvk.keys())]
+        quantity = export_data["Quantity"]
+        export_csv += export_data.loc[(quantity != 0) | quantity.isna()].to_csv(
+            index=False, header=not export_csv
+        )
+    return template(export_csv)
 
 
 @app.route("/export")
@@ -1290,9 +1594,10 @@ def export_page():
     """
 
     # Determine oldest record
-    earliest_record = get_table("SELECT MIN(Date) Earliest FROM moth_records;")[
-        "Earliest"
-    ][0]
+    earliest_record = get_table(
+        "SELECT MIN(Date) Earliest FROM moth_records;",
+        dtypes={"Earliest": "datetime64[ns]"},
+    )["Earliest"][0]
     moth_logger.debug(">>>>", earliest_record.year)
     return template(
         "export", e_year=earliest_record.year, e_month=earliest_record.month
@@ -1326,13 +1631,14 @@ def config_options():
     """ Configuration page for options
     """
 
-    recorder_list = get_table("SELECT * from recorders_list;")
-    trap_list = get_table("SELECT * from traps_list;")
-    location_list = get_table("SELECT * from locations_list;")
+    recorder_list = schema_cache.option_table("Recorder")
+    trap_list = schema_cache.option_table("Trap")
+    location_list = schema_cache.option_table("Location")
 
-    def_location = update_moth_taxonomy.get_column_default("Location")
-    def_recorder = update_moth_taxonomy.get_column_default("Recorder")
-    def_trap = update_moth_taxonomy.get_column_default("Trap")
+    defaults = schema_cache.column_defaults()
+    def_location = defaults.get("Location")
+    def_recorder = defaults.get("Recorder")
+    def_trap = defaults.get("Trap")
 
     return template(
         "options",
@@ -1358,11 +1664,7 @@ def config_add_option():
 
     option_data = json.loads(request.forms["option_data"])
     # A map of column name from moth_records table to its options table
-    options_map = {
-        "Location": "locations_list",
-        "Trap": "traps_list",
-        "Recorder": "recorders_list",
-    }
+    options_map = schema_cache.OPTION_TABLES
 
     # Option
     option_name = option_data["name"]
@@ -1374,7 +1676,7 @@ def config_add_option():
         option_default = "NULL"
 
     # Empty table
-    get_table(f"TRUNCATE {options_map[option_name]}")
+    get_table(f"DELETE FROM {options_map[option_name]};")
 
     # Refill table
     for opt_details in option_options:
@@ -1382,25 +1684,39 @@ def config_add_option():
         get_table(
             f"INSERT INTO {options_map[option_name]} VALUES ({', '.join(quote_list)});"
         )
+    schema_cache.invalidate()
 
-    # Update default in moth_records
+    # Update default in moth_records (this also invalidates the cache)
     update_moth_taxonomy.set_column_default(option_name, option_default)
+    route_cache.invalidate([("options",)])  # e.g. the exports' grid references
     return config_options()
 
 
+moth_logger.info(f"Imported in {startup.mark('imported')}s")
+
+
 if __name__ == "__main__":
     #    app = ProfilerMiddleware(app,
     #                             profile_dir = '/var/www/profile',
     #                             filename_format = "moths_bottle_{time}.prof")
 
-    # Check whether database needs an update
-    update_moth_taxonomy.update_table_moth_taxonomy()
+    # With the reloader this process only watches the files, the child serves
+    reloader = cfg.get("RELOADER", False)
+    if not reloader or os.environ.get("BOTTLE_CHILD"):
+        # Check whether database needs an update
+        with startup.timed("schema"):
+            update_moth_taxonomy.update_table_moth_taxonomy()
+        with startup.timed("taxonomy"):
+            taxonomy_cache.get_taxonomy()  # Load the taxonomy before the first request
+        moth_logger.info(f"Ready to serve in {startup.mark('ready')}s")
+        warm_pages()
+        get_survey_journal().start()  # Saves surveys journalled before a restart
 
     # Run server
     run(
         app=app,
         debug=True,
-        reloader=True,
+        reloader=reloader,
         host=cfg["HOST"],
         port=cfg["PORT"],
         server="waitress",
@@ -0,0 +1,191 @@
+""" plotly_json.py
+
+Writes plotly figure JSON straight from numpy arrays.
+
+Building a graph with plotly.graph_objects (or pandas' plotly backend) validates
+and copies every property, then fig.to_json() walks the whole figure again, which
+was most of the time spent on a graph. The graphs here are always the same few
+traces, so they are now written as plain dicts
+
+    {"data": [trace, ...], "layout": {"template": <plotly template>, ...}}
+
+holding exactly what the plotly code produced, so the browser draws the same graph.
+line_traces() and express_layout() give what DataFrame.plot() (plotly express) adds.
+
+The default plotly template is serialised once and spliced into every graph. Arrays
+are encoded by orjson when it is installed (as plotly itself does), otherwise by json
+after converting them to lists.
+
+Usage:
+    traces = plotly_json.line_traces(season_df)
+    layout = plotly_json.merge(plotly_json.express_layout(season_df), line_layout)
+    return plotly_json.to_json(traces, layout)
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import json
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+WEBGL_POINTS = 1000  # plotly express draws with scattergl above this many points
+
+
+def _to_list(value):
+    """ json.dumps default for what json can't encode """
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == "M":
+            return np.datetime_as_string(value.astype("datetime64[s]")).tolist()
+        if value.dtype.kind == "f":
+            return np.where(np.isnan(value), None, value).tolist()
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Can't encode {type(value)} as JSON")
+
+
+def _dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(obj, default=_to_list, separators=(",", ":"))
+
+
+def _array(values):
+    """ values (Series, Index, array or list) in a form _dumps encodes as plotly
+        does: numbers as numbers, NaN as null and dates as ISO strings """
+    if isinstance(values, list):
+        return values
+    values = np.asarray(values.to_numpy() if hasattr(values, "to_numpy") else values)
+    if values.dtype.kind == "O":
+        return values.tolist()
+    return np.ascontiguousarray(values)
+
+
+@lru_cache(maxsize=1)
+def template_json():
+    """ The default plotly template, as plotly writes it into a figure """
+    import plotly.io as pio
+
+    return _dumps(pio.templates[pio.templates.default].to_plotly_json())
+
+
+@lru_cache(maxsize=1)
+def colorway():
+    """ The trace colours of the default template """
+    return json.loads(template_json())["layout"]["colorway"]
+
+
+def merge(*layouts):
+    """ A new layout with each of layouts applied in turn, nested dicts being
+        merged like fig.update_layout() """
+    merged = {}
+    for layout in layouts:
+        for name, value in layout.items():
+            if isinstance(value, dict) and isinstance(merged.get(name), dict):
+                merged[name] = merge(merged[name], value)
+            elif isinstance(value, dict):
+                merged[name] = merge(value)
+            else:
+                merged[name] = value
+    return merged
+
+
+def scatter(x, y, name, mode="lines"):
+    """ A go.Scatter trace """
+    return {
+        "mode": mode,
+        "name": str(name),
+        "x": _array(x),
+        "y": _array(y),
+        "type": "scatter",
+    }
+
+
+def bar(x, y, name, color=None, width=None):
+    """ A go.Bar trace """
+    trace = {"name": str(name), "x": _array(x), "y": _array(y), "type": "bar"}
+    if color is not None:
+        trace["marker"] = {"color": color}
+    if width is not None:
+        trace["width"] = width
+    return trace
+
+
+def line_traces(df):
+    """ The traces DataFrame.plot() draws, a line for each column against the index
+    """
+    legend = df.columns.name or "variable"
+    x_title = df.index.name or "index"
+    trace_type = "scattergl" if df.size > WEBGL_POINTS else "scatter"
+    colours = colorway()
+    x = _array(df.index)
+
+    traces = []
+    for i, column in enumerate(df.columns):
+        trace = {
+            "hovertemplate": (
+                f"{legend}={column}<br>{x_title}=%{{x}}<br>value=%{{y}}<extra></extra>"
+            ),
+            "legendgroup": str(column),
+            "line": {"color": colours[i % len(colours)], "dash": "solid"},
+            "marker": {"symbol": "circle"},
+            "mode": "lines",
+            "name": str(column),
+            "showlegend": True,
+            "x": x,
+            "xaxis": "x",
+            "y": _array(df.iloc[:, i]),
+            "yaxis": "y",
+            "type": trace_type,
+        }
+        if trace_type == "scatter":
+            trace["orientation"] = "v"
+        traces.append(trace)
+    return traces
+
+
+def express_layout(df):
+    """ The layout DataFrame.plot() starts from (before any updates) """
+    return {
+        "xaxis": {
+            "anchor": "y",
+            "domain": [0.0, 1.0],
+            "title": {"text": df.index.name or "index"},
+        },
+        "yaxis": {"anchor": "x", "domain": [0.0, 1.0], "title": {"text": "value"}},
+        "legend": {
+            "title": {"text": df.columns.name or "variable"},
+            "tracegroupgap": 0,
+        },
+        "margin": {"t": 60},
+    }
+
+
+def today_marker(date):
+    """ Shape drawing a dotted vertical line at date, from bottom to top """
+    return {
+        "line": {"color": "Black", "dash": "dot", "width": 3},
+        "type": "line",
+        "x0": date.isoformat(),
+        "x1": date.isoformat(),
+        "y0": 0,
+        "y1": 1,
+        "yref": "paper",
+    }
+
+
+def to_json(data, layout):
+    """ The figure JSON of the traces in data and layout (without its template) """
+    layout_json = '{"template":' + template_json()
+    if layout:
+        layout_json += "," + _dumps(layout)[1:]
+    else:
+        layout_json += "}"
+    return '{"data":' + _dumps(data) + ',"layout":' + layout_json + "}"
@@ -0,0 +1,102 @@
+""" rollups.py
+
+Pre-aggregated totals of moth_records, kept up to date as surveys are submitted.
+
+The summary, species, genus and family pages only need the number of each species
+caught per month, yet they used to GROUP BY the whole of moth_records on every
+visit. The rollup_month table holds one row per (Year, Month, MothName):
+
+    Year  Month  MothName         Total
+    2020      6  Heart and Dart     112
+
+which is a few thousand rows rather than the full record history. Yearly totals are
+the sum of the months. The rows are keyed by MothName rather than TVK so installing
+a new taxonomy doesn't invalidate them; the routes map names to TVK, genus or family
+through taxonomy_cache.
+
+update_month() recomputes the rows of the month containing a date and is called on
+the same cursor as the survey write. rebuild() recomputes everything, e.g. after moth
+names have been remapped (or POST to /rebuild_rollups, or run python rollups.py), and
+bumps the records data version so every process drops the pages built from them.
+
+History
+-------
+18 Oct 2026 - rebuild() bumps the records data version
+18 Oct 2026 - Genesis
+"""
+import datetime as dt
+
+import data_version
+import db_pool
+
+ROLLUP_TABLE = "rollup_month"
+
+
+def _insert_totals_sql(where=""):
+    return (
+        f"INSERT INTO {ROLLUP_TABLE} (Year, Month, MothName, Total) "
+        "SELECT year(Date) Year, month(Date) Month, MothName, SUM(MothCount) Total "
+        f"FROM moth_records WHERE MothName IS NOT NULL{where} "
+        "GROUP BY Year, Month, MothName;"
+    )
+
+
+def create(cursor):
+    """ Create the rollup table if it doesn't exist """
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} ("
+        "Year SMALLINT NOT NULL, Month TINYINT NOT NULL, "
+        "MothName VARCHAR(50) NOT NULL, Total INT NOT NULL, "
+        "PRIMARY KEY (Year, Month, MothName));"
+    )
+
+
+def ensure(cursor):
+    """ Create the rollup table and fill it if it is empty but records exist """
+    create(cursor)
+    cursor.execute(f"SELECT 1 FROM {ROLLUP_TABLE} LIMIT 1;")
+    has_rollups = cursor.fetchall()
+    cursor.execute("SELECT 1 FROM moth_records WHERE MothName IS NOT NULL LIMIT 1;")
+    if cursor.fetchall() and not has_rollups:
+        print("Building rollup tables")
+        _rebuild(cursor)
+
+
+def update_month(cursor, date):
+    """ Recompute the rollup rows for the month containing date
+        (a datetime.date or "YYYY-MM-DD" string) """
+    if isinstance(date, str):
+        date = dt.date.fromisoformat(date)
+    first = date.replace(day=1)
+    following = (first + dt.timedelta(days=32)).replace(day=1)
+
+    cursor.execute(
+        f"DELETE FROM {ROLLUP_TABLE} WHERE Year = %s AND Month = %s;",
+        (first.year, first.month),
+    )
+    cursor.execute(
+        _insert_totals_sql(" AND Date >= %s AND Date < %s"),
+        (first.isoformat(), following.isoformat()),
+    )
+
+
+def _rebuild(cursor):
+    cursor.execute(f"DELETE FROM {ROLLUP_TABLE};")
+    cursor.execute(_insert_totals_sql())
+
+
+def rebuild():
+    """ Recompute all the rollups from moth_records in one transaction, so pages
+        never see a half built table. """
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        create(cursor)
+        cnx.start_transaction()
+        _rebuild(cursor)
+        cnx.commit()
+        cursor.close()
+    data_version.bump("records")
+
+
+if __name__ == "__main__":
+    rebuild()
@@ -0,0 +1,168 @@
+""" route_cache.py
+
+Caches route outputs along with what they depend on, so that submitting a survey
+only throws away the pages it affects.
+
+Each cached entry is tagged with the data it was built from, e.g.
+
+    ("tvk", "NBNSYS0000003422")   - the records of one species
+    ("year", 2020)                - the records of one year
+    ("records",)                  - any of the records
+    ("options",)                  - the locations, traps and recorders lists
+
+and after a write, invalidate() is given the tags that write touched. Submitting
+one night's survey therefore drops the pages of the species caught that night, the
+summary and that year's export, and keeps every other species page.
+
+Pages that show today (the current year, the "today" line on a graph, this month's
+grid) have the date in their key, so they are rebuilt after midnight rather than
+being served with yesterday's view.
+
+If the records, taxonomy or options are changed by another process (their data version
+moves without invalidate() being called here) everything is dropped.
+
+Usage:
+    @route_cache.cached(maxsize=16, tags=lambda species: [("tvk", ...)])
+    def get_pspecies(species):
+        ...
+
+    route_cache.invalidate([("tvk", "NBNSYS0000003422"), ("records",)])
+
+History
+-------
+18 Oct 2026 - Pages can depend on the options, e.g. the export's grid references
+18 Oct 2026 - Genesis
+"""
+import datetime as dt
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import data_version
+
+DATA_NAMES = ("records", "taxonomy", "options")
+
+_lock = threading.Lock()
+_caches = []
+_versions = None
+_generation = 0  # Moves on whenever entries are dropped
+
+
+def _data_versions():
+    return tuple(data_version.version(name) for name in DATA_NAMES)
+
+
+class RouteCache:
+    """ LRU cache of up to maxsize entries, each with a set of tags """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key -> (value, tags)
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def get(self, key):
+        """ Returns (True, value) if key is cached, else (False, None) """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0]
+
+    def put(self, key, value, tags):
+        self.entries[key] = (value, frozenset(tags))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, tags):
+        stale = [key for key, (_, t) in self.entries.items() if not t.isdisjoint(tags)]
+        for key in stale:
+            del self.entries[key]
+        self.invalidated += len(stale)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def _check_versions():
+    """ Drop everything if the data was changed behind our back """
+    global _versions, _generation
+    current = _data_versions()
+    if current != _versions:
+        for cache in _caches:
+            cache.clear()
+        _versions = current
+        _generation += 1
+
+
+def invalidate(tags):
+    """ Drop the entries depending on any of tags. Call after changing the data. """
+    global _versions, _generation
+    tags = set(tags)
+    with _lock:
+        for cache in _caches:
+            cache.invalidate(tags)
+        _versions = _data_versions()
+        _generation += 1
+
+
+def clear():
+    """ Drop every cached route """
+    global _generation
+    with _lock:
+        for cache in _caches:
+            cache.clear()
+        _generation += 1
+
+
+def cached(maxsize=16, tags=None, by_date=True):
+    """ Decorator caching a route's output.
+
+        maxsize - number of outputs kept for this route
+        tags    - function of the route's arguments returning the tags it depends
+                  on, default [("records",)]
+        by_date - True if the output depends on today's date
+    """
+
+    def decorator(fn):
+        cache = RouteCache(maxsize)
+        _caches.append(cache)
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            if by_date:
+                key += (dt.date.today(),)
+            with _lock:
+                _check_versions()
+                hit, value = cache.get(key)
+                generation = _generation
+            if hit:
+                return value
+
+            value = fn(*args, **kwargs)
+            entry_tags = tags(*args, **kwargs) if tags else [("records",)]
+            with _lock:
+                # Don't keep it if the data changed while it was being built
+                if generation == _generation:
+                    cache.put(key, value, entry_tags)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+def stats():
+    with _lock:
+        return {
+            "entries": sum(len(c.entries) for c in _caches),
+            "hits": sum(c.hits for c in _caches),
+            "misses": sum(c.misses for c in _caches),
+            "invalidated": sum(c.invalidated for c in _caches),
+        }
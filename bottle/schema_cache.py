@@ -0,0 +1,62 @@
+""" schema_cache.py
+
+In memory cache of the survey options: the moth_records column defaults and the
+recorders, traps and locations lists.
+
+These change only when somebody edits them on the /options page, yet the survey sheet
+and options page used to query them (and DESCRIBE moth_records three times) on every
+request. They are now loaded once, and reloaded only after set_column_default or
+config_add_option call invalidate(). The "options" data version (see data_version.py)
+keeps every server process coherent.
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import pandas as pd
+
+import data_version
+import db_pool
+import storage
+
+# A map of column name from moth_records table to its options table
+OPTION_TABLES = {
+    "Location": "locations_list",
+    "Trap": "traps_list",
+    "Recorder": "recorders_list",
+}
+
+
+def _load_options():
+    """ Read the column defaults and options tables in one connection. """
+    options = {}
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        options["defaults"] = storage.get_backend().column_defaults(
+            cursor, "moth_records"
+        )
+        for column, table in OPTION_TABLES.items():
+            cursor.execute(f"SELECT * from {table};")
+            rows = [list(r) for r in cursor]
+            options[column] = pd.DataFrame(rows, columns=list(cursor.column_names))
+        cursor.close()
+    return options
+
+
+options_cache = data_version.VersionedCache("options", _load_options)
+
+
+def column_defaults():
+    """ Returns a dict of the moth_records column defaults """
+    return options_cache.get()["defaults"]
+
+
+def option_table(column):
+    """ Returns the options table for column (Location, Trap or Recorder) as a
+        DataFrame. Treat it as read only, it is shared."""
+    return options_cache.get()[column]
+
+
+def invalidate():
+    """ Call after changing a column default or an options table. """
+    options_cache.invalidate()
@@ -0,0 +1,72 @@
+""" seasonal.py
+
+Helpers for plotting catches against the time of year, whichever year they were
+caught in.
+
+Dates are mapped onto BASE_YEAR, a leap year so that 29 Feb has somewhere to go,
+and graphs share one 366 day axis. The mapping is done with datetime64 arithmetic
+on whole arrays rather than calling date.replace(year=BASE_YEAR) on every record:
+
+    day of year offset = date - 1 Jan of its year
+    + 1 day from March onwards in a non leap year (skipping BASE_YEAR's 29 Feb)
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+BASE_YEAR = 2000  # Needs to be a leap year so we can map all days onto the same graph
+
+_BASE_NYD = np.datetime64(f"{BASE_YEAR}-01-01", "D")
+_MARCH_1ST = np.timedelta64(59, "D")  # Offset of 1 March in a non leap year
+_ONE_DAY = np.timedelta64(1, "D")
+
+
+def _as_days(dates):
+    return np.asarray(dates, dtype="datetime64[D]")
+
+
+def year_of(dates):
+    """ Array of the (int) year of each date in dates """
+    return _as_days(dates).astype("datetime64[Y]").astype(int) + 1970
+
+
+def is_leap(years):
+    years = np.asarray(years)
+    return (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+
+
+def to_base_year(dates):
+    """ Map dates (any array-like of dates or datetime64) onto the same day and
+        month of BASE_YEAR. Returns datetime64[ns] in the same form as dates,
+        a Series if given a Series (keeping its index), otherwise a DatetimeIndex.
+    """
+    days = _as_days(dates)
+    new_year = days.astype("datetime64[Y]")
+    offset = days - new_year
+    skip_leap_day = ~is_leap(year_of(new_year)) & (offset >= _MARCH_1ST)
+    base_days = (_BASE_NYD + offset + skip_leap_day * _ONE_DAY).astype("datetime64[ns]")
+    if isinstance(dates, pd.Series):
+        return pd.Series(base_days, index=dates.index, name=dates.name)
+    return pd.DatetimeIndex(base_days)
+
+
+def base_date(date):
+    """ A single datetime.date moved to the same day and month in BASE_YEAR """
+    return date.replace(year=BASE_YEAR)
+
+
+@lru_cache(maxsize=1)
+def season_axis():
+    """ The 366 days of BASE_YEAR, a DatetimeIndex shared by the graphs """
+    return pd.date_range(start=f"{BASE_YEAR}-01-01", end=f"{BASE_YEAR}-12-31")
+
+
+def reindex_season(data, fill_value=0):
+    """ Reindex a Series or DataFrame indexed by BASE_YEAR dates onto every day of
+        the season axis, filling days without data. """
+    return data.reindex(season_axis(), fill_value=fill_value)
@@ -0,0 +1,122 @@
+""" species_curve.py
+
+The cumulative species curves on the /summary graph: for each year, the number of
+different species seen by each day of the year.
+
+The graph used to pivot every (Year, Date, MothName) into one wide frame and forward
+fill it, so time and memory grew with days x species x years. Instead each year is
+reduced to the day each species was first seen, and the number of new species per
+day. A curve is then the cumulative sum of those counts over the days moths were
+recorded (in any year, mapped onto seasonal.BASE_YEAR so the years overlay).
+
+Only the new species counts and recorded days are held per year, so when a night's
+records are submitted refresh_year() re-reads just that year. Another process
+changing the records bumps the "records" data version and everything is reloaded.
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import threading
+
+import pandas as pd
+
+import columnar
+import data_version
+import db_pool
+import seasonal
+
+CURVE_DTYPES = {"Date": "datetime64[ns]", "MothName": "category"}
+
+
+def _fetch_records(year=None):
+    """ Date and MothName of every named record, or just those in year """
+    where, params = "", None
+    if year is not None:
+        where = " AND Date >= %s AND Date < %s"
+        params = (f"{year}-01-01", f"{year + 1}-01-01")
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            "SELECT Date, MothName FROM moth_records "
+            f"WHERE MothName IS NOT NULL{where};",
+            params,
+        )
+        records = columnar.frame_from_cursor(cursor, CURVE_DTYPES)
+        cursor.close()
+    return records
+
+
+class SpeciesCurves:
+    """ Cumulative species count per day, for each year.
+
+        Usage:
+            species_curves = SpeciesCurves()
+            species_curves.curves()            # DataFrame, index Year, columns Date
+            species_curves.refresh_year(2020)  # after changing 2020's records
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._new_species = {}  # year -> Series of new species count by day
+        self._days = {}  # year -> DatetimeIndex of days with records
+
+    def _summarise(self, records):
+        """ Returns {year: (new species per day, recorded days)} for records """
+        dates = records["Date"]
+        records = pd.DataFrame(
+            {
+                "Year": seasonal.year_of(dates),
+                "Day": seasonal.to_base_year(dates),
+                "MothName": records["MothName"],
+            }
+        )
+        first_seen = records.groupby(["Year", "MothName"], observed=True)["Day"].min()
+
+        summary = {}
+        for year, days in records.groupby("Year")["Day"]:
+            new_species = first_seen.loc[year].value_counts().sort_index()
+            summary[year] = (new_species, pd.DatetimeIndex(days.unique()))
+        return summary
+
+    def _load(self):
+        current = data_version.version("records")
+        summary = self._summarise(_fetch_records())
+        self._new_species = {year: s[0] for year, s in summary.items()}
+        self._days = {year: s[1] for year, s in summary.items()}
+        self._version = current
+
+    def refresh_year(self, year):
+        """ Re-read the records of one year, call after they have been changed.
+            Assumes this process made the latest change to the records. """
+        with self._lock:
+            if self._version is None:
+                return  # Not loaded yet, curves() will load everything
+            current = data_version.version("records")
+            summary = self._summarise(_fetch_records(year))
+            if year in summary:
+                self._new_species[year], self._days[year] = summary[year]
+            else:
+                self._new_species.pop(year, None)
+                self._days.pop(year, None)
+            self._version = current
+
+    def curves(self):
+        """ DataFrame of the cumulative species count (float), index Year and a
+            column for every Date moths were recorded in any year.
+            Returns an empty DataFrame if there are no records."""
+        with self._lock:
+            if self._version != data_version.version("records"):
+                self._load()
+            if not self._new_species:
+                return pd.DataFrame()
+
+            days = self._days.values()
+            columns = pd.DatetimeIndex(sorted(set().union(*days)), name="Date")
+            years = sorted(self._new_species)
+            new_species = pd.DataFrame(
+                [self._new_species[y].reindex(columns, fill_value=0) for y in years],
+                index=pd.Index(years, name="Year"),
+            )
+        return new_species.cumsum(axis=1).astype(float)
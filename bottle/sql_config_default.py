@@ -1,4 +1,7 @@
 sql_config = {
+    # Storage backend "mariadb" or "sqlite" - see storage.py
+    "backend": "mariadb",
+    "sqlite_file": "moths.db",
     "user": "moths",
     "password": "moths12345",
     "host": "localhost",
@@ -6,4 +9,9 @@ sql_config = {
     "database": "moths_database",
     # 'raise_on_warnings': True
     "autocommit": True,
+    # Connection pool - see db_pool.py
+    "pool_size": 4,
+    "pool_timeout": 10,
+    "pool_recycle": 3600,
+    "pool_ping_interval": 30,
 }
@@ -0,0 +1,33 @@
+""" startup.py
+
+Times the server's start up, so a slow boot on the Pi can be seen rather than
+guessed at. moths_bottle imports this module first, and the times (in seconds from
+then) of each step are logged and shown in /status, e.g.
+
+    {"imported": 1.84, "schema": 1.9, "taxonomy": 2.05, "ready": 2.05}
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import time
+from contextlib import contextmanager
+
+START = time.perf_counter()
+
+timings = {}
+
+
+def mark(step):
+    """ Record that step has just finished """
+    timings[step] = round(time.perf_counter() - START, 3)
+    return timings[step]
+
+
+@contextmanager
+def timed(step):
+    """ Context manager marking step when its block finishes """
+    try:
+        yield
+    finally:
+        mark(step)
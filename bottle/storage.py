@@ -0,0 +1,351 @@
+""" storage.py
+
+Pluggable storage backends for the moths database.
+
+The backend is chosen by sql_config["backend"]:
+    "mariadb" (default) - a MariaDB/MySQL server reached via mysql.connector
+    "sqlite"            - an embedded SQLite file, sql_config["sqlite_file"]
+
+The SQLite backend lets a small site run without a database server at all (and lets
+the whole app and its benchmarks run in-process). Connections are opened in WAL
+mode with a few tuned pragmas, and the handful of MariaDB functions used in our
+queries (YEAR, MONTH, CEIL, CONCAT) are registered so the existing SQL runs as is.
+
+Anything that can't be expressed in SQL common to both lives on the backend:
+adding columns, column defaults, table update times and the auto id column type.
+
+History
+-------
+18 Oct 2026 - is_transient() tells errors worth retrying from bad data or SQL
+18 Oct 2026 - FOR_UPDATE locks the rows a transaction reads to change
+18 Oct 2026 - replace_table() swaps in a rebuilt table atomically
+18 Oct 2026 - Genesis
+"""
+import datetime as dt
+import math
+import sqlite3
+import threading
+
+try:
+    from sql_config_local import sql_config
+except ModuleNotFoundError:
+    from sql_config_default import sql_config
+
+# Keys in sql_config used to choose and configure the backend, not for connect()
+# (the pool_* keys are used by db_pool)
+BACKEND_KEYS = ("backend", "sqlite_file", "sqlite_pragmas")
+
+SQLITE_BUSY = 5  # Result codes of another connection holding a lock
+SQLITE_LOCKED = 6
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # Safe with WAL and far fewer fsyncs on the SD card
+    "busy_timeout": 5000,
+    "cache_size": -16000,  # 16MB
+    "temp_store": "MEMORY",
+    "mmap_size": 64 * 1024 * 1024,
+}
+
+
+class MariaDBBackend:
+    """ MariaDB/MySQL server via mysql.connector """
+
+    name = "mariadb"
+    AUTO_ID = "Id INT AUTO_INCREMENT PRIMARY KEY"
+    FOR_UPDATE = " FOR UPDATE"  # Locks the rows a SELECT in a transaction reads
+
+    def connect(self, config):
+        import mysql.connector
+
+        return mysql.connector.connect(**connect_args(config))
+
+    def add_column(self, cursor, table, column, col_type):
+        """ Add a column to table if it doesn't already exist. """
+        cursor.execute(
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {col_type};"
+        )
+
+    def column_defaults(self, cursor, table):
+        """ Return a dict of column name to column default. """
+        cursor.execute(f"DESCRIBE {table};")
+        return {row[0]: row[4] for row in cursor.fetchall()}
+
+    def is_transient(self, error):
+        """ True if error is from the server being down or busy, so worth retrying """
+        from mysql.connector import errorcode, errors
+
+        return isinstance(error, (errors.OperationalError, errors.InterfaceError)) or (
+            getattr(error, "errno", None)
+            in (errorcode.ER_LOCK_WAIT_TIMEOUT, errorcode.ER_LOCK_DEADLOCK)
+        )
+
+    def set_column_default(self, cursor, table, column, value):
+        """ Set (value=None to remove) the default value for a column """
+        if value is None:
+            cursor.execute(f"ALTER TABLE {table} ALTER {column} SET DEFAULT NULL;")
+        else:
+            cursor.execute(
+                f"ALTER TABLE {table} ALTER {column} SET DEFAULT %s;", (value,)
+            )
+
+    def replace_table(self, cnx, cursor, table, build):
+        """ Replace table with the one build(name) creates (and fills) as name.
+
+            It is built as a shadow table, then swapped in with one atomic RENAME,
+            so readers see either the old table or the whole new one.
+        """
+        shadow = f"{table}_new"
+        try:
+            build(shadow)
+        except Exception:
+            cursor.execute(f"DROP TABLE IF EXISTS {shadow};")
+            raise
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} LIKE {shadow};")
+        cursor.execute(f"DROP TABLE IF EXISTS {table}_old;")
+        cursor.execute(f"RENAME TABLE {table} TO {table}_old, {shadow} TO {table};")
+        cursor.execute(f"DROP TABLE {table}_old;")
+
+    def update_time(self, cursor, table):
+        """ The time table was last changed, or None if the server doesn't know """
+        cursor.execute(
+            "SELECT update_time FROM information_schema.tables "
+            "WHERE TABLE_SCHEMA = %s AND table_name = %s;",
+            (sql_config["database"], table),
+        )
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+
+class SQLiteCursor:
+    """ Wraps a sqlite3 cursor to look enough like a mysql.connector cursor. """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @staticmethod
+    def _sql(operation, params):
+        # mysql.connector uses %s placeholders, only substituted when given params
+        return operation if params is None else operation.replace("%s", "?")
+
+    def execute(self, operation, params=None, multi=False):
+        self._cursor.execute(self._sql(operation, params), params or ())
+
+    def executemany(self, operation, seq_params):
+        self._cursor.executemany(self._sql(operation, ()), seq_params)
+
+    @property
+    def column_names(self):
+        return tuple(d[0] for d in self._cursor.description or ())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """ Wraps a sqlite3 connection to look enough like a mysql.connector one.
+        Statements autocommit unless start_transaction() has been called."""
+
+    def __init__(self, cnx):
+        self._cnx = cnx
+
+    def cursor(self):
+        return SQLiteCursor(self._cnx.cursor())
+
+    def start_transaction(self):
+        self._cnx.execute("BEGIN IMMEDIATE;")
+
+    @property
+    def in_transaction(self):
+        return self._cnx.in_transaction
+
+    def commit(self):
+        if self._cnx.in_transaction:
+            self._cnx.execute("COMMIT;")
+
+    def rollback(self):
+        if self._cnx.in_transaction:
+            self._cnx.execute("ROLLBACK;")
+
+    def is_connected(self):
+        try:
+            self._cnx.execute("SELECT 1;")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close(self):
+        self._cnx.close()
+
+
+def _sql_year(value):
+    return None if value is None else int(str(value)[0:4])
+
+
+def _sql_month(value):
+    return None if value is None else int(str(value)[5:7])
+
+
+def _sql_ceil(value):
+    return None if value is None else math.ceil(value)
+
+
+def _sql_concat(*values):
+    # Like MariaDB, CONCAT with any NULL argument is NULL
+    return None if None in values else "".join(str(v) for v in values)
+
+
+def _convert_date(value):
+    return dt.date.fromisoformat(value.decode()[0:10])
+
+
+class SQLiteBackend:
+    """ Embedded SQLite database file """
+
+    name = "sqlite"
+    AUTO_ID = "Id INTEGER PRIMARY KEY AUTOINCREMENT"
+    FOR_UPDATE = ""  # start_transaction() already takes the write lock
+
+    _registered = False
+    _register_lock = threading.Lock()
+
+    def connect(self, config):
+        with self._register_lock:
+            if not SQLiteBackend._registered:
+                sqlite3.register_converter("DATE", _convert_date)
+                SQLiteBackend._registered = True
+
+        cnx = sqlite3.connect(
+            config.get("sqlite_file", "moths.db"),
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,  # autocommit, as we configure mariadb
+            check_same_thread=False,  # The pool only lends it to one thread at a time
+        )
+        pragmas = dict(SQLITE_PRAGMAS, **config.get("sqlite_pragmas", {}))
+        for pragma, value in pragmas.items():
+            cnx.execute(f"PRAGMA {pragma}={value};")
+
+        cnx.create_function("year", 1, _sql_year, deterministic=True)
+        cnx.create_function("month", 1, _sql_month, deterministic=True)
+        cnx.create_function("ceil", 1, _sql_ceil, deterministic=True)
+        cnx.create_function("concat", -1, _sql_concat, deterministic=True)
+        return SQLiteConnection(cnx)
+
+    def add_column(self, cursor, table, column, col_type):
+        """ Add a column to table if it doesn't already exist. """
+        if column not in self._columns(cursor, table):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {col_type};")
+
+    @staticmethod
+    def _columns(cursor, table):
+        cursor.execute(f"PRAGMA table_info({table});")
+        return {row[1]: row[4] for row in cursor.fetchall()}
+
+    def is_transient(self, error):
+        """ True if error is from the database being busy or locked, so worth
+            retrying. Other OperationalErrors (no such table, bad SQL) aren't. """
+        if not isinstance(error, sqlite3.OperationalError):
+            return False
+        code = getattr(error, "sqlite_errorcode", None)  # Python 3.11+
+        if code is not None:
+            return code & 0xFF in (SQLITE_BUSY, SQLITE_LOCKED)  # Or extended codes
+        return str(error).startswith(
+            ("database is locked", "database is busy", "database table is locked")
+        )
+
+    def column_defaults(self, cursor, table):
+        """ Return a dict of column name to column default.
+
+            SQLite can't alter a column default in place, so defaults set through
+            set_column_default are kept in the column_defaults table.
+        """
+        defaults = {
+            col: None if default is None else default.strip("'\"")
+            for col, default in self._columns(cursor, table).items()
+        }
+        self._create_defaults_table(cursor)
+        cursor.execute(
+            "SELECT Field, DefaultValue FROM column_defaults WHERE TableName = ?;",
+            (table,),
+        )
+        defaults.update(dict(cursor.fetchall()))
+        return defaults
+
+    def set_column_default(self, cursor, table, column, value):
+        """ Set (value=None to remove) the default value for a column """
+        self._create_defaults_table(cursor)
+        cursor.execute(
+            "INSERT OR REPLACE INTO column_defaults (TableName, Field, DefaultValue) "
+            "VALUES (?, ?, ?);",
+            (table, column, value),
+        )
+
+    @staticmethod
+    def _create_defaults_table(cursor):
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS column_defaults (TableName CHAR(64) NOT NULL, "
+            "Field CHAR(64) NOT NULL, DefaultValue CHAR(64), "
+            "PRIMARY KEY (TableName, Field));"
+        )
+
+    def replace_table(self, cnx, cursor, table, build):
+        """ Replace table with the one build(name) creates (and fills) as name.
+
+            SQLite DDL is transactional (and index names are global, so a shadow
+            table's indexes couldn't take the live names), so table is rebuilt in
+            place in one transaction. Readers see the old table until it commits.
+        """
+        cnx.start_transaction()
+        try:
+            build(table)
+        except Exception:
+            cnx.rollback()
+            raise
+        cnx.commit()
+
+    def update_time(self, cursor, table):
+        """ SQLite doesn't record when a table changed. """
+        return None
+
+
+BACKENDS = {"mariadb": MariaDBBackend, "sqlite": SQLiteBackend}
+
+
+def connect_args(config=sql_config):
+    """ The mysql.connector arguments in config, without pool or backend settings """
+    return {
+        k: v
+        for k, v in config.items()
+        if k not in BACKEND_KEYS and not k.startswith("pool_")
+    }
+
+
+_backend = None
+
+
+def get_backend():
+    """ Return the backend selected in sql_config """
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[sql_config.get("backend", "mariadb")]()
+    return _backend
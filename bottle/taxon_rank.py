@@ -0,0 +1,146 @@
+""" taxon_rank.py
+
+Daily catch counts aggregated by family, subfamily, genus or species, behind the
+/family, /subfamily and /genus pages.
+
+Each page used to join moth_records to the taxonomy with a LIKE and rebuild the
+same pivot. Now the nightly totals of every moth name are read once,
+
+    Date        MothName         MothCount
+    2020-06-01  Heart and Dart          12
+
+and summed into a (taxon, Date) count for each rank the first time that rank is
+asked for. These are kept until the "records" or "taxonomy" data version changes,
+so browsing from family to family only slices what is already in memory.
+
+The "species" rank groups names by TVK, so common and scientific names are one
+species. Taxa are matched ignoring case, like the SQL they replace.
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import threading
+
+import pandas as pd
+
+import columnar
+import data_version
+import db_pool
+import seasonal
+import taxonomy_cache
+
+RANKS = ("family", "subfamily", "genus", "species")
+
+DAILY_DTYPES = {
+    "Date": "datetime64[ns]",
+    "MothName": "category",
+    "MothCount": "int32",
+}
+
+
+def _load_daily():
+    """ Total count of each moth name on each date """
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            "SELECT Date, MothName, SUM(MothCount) MothCount FROM moth_records "
+            "WHERE MothName IS NOT NULL GROUP BY Date, MothName;"
+        )
+        daily = columnar.frame_from_cursor(cursor, DAILY_DTYPES)
+        cursor.close()
+    return daily
+
+
+def _versions():
+    return data_version.version("records"), data_version.version("taxonomy")
+
+
+class TaxonRanks:
+    """ Daily counts per taxon for each rank, cached on the data versions. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None
+        self._daily = None
+        self._by_rank = {}
+
+    def _rank_key(self, rank, taxonomy):
+        """ dict of moth name to the (lower case) taxon it belongs to at rank """
+        if rank == "species":
+            return taxonomy.name_to_tvk
+        return {
+            name: taxon.lower()
+            for name, taxon in taxonomy.rank_map(rank).items()
+            if taxon
+        }
+
+    def _counts(self, rank):
+        """ (taxon, Date) -> count Series and (taxon, MothName) -> first date
+            for rank, built on first use """
+        if rank not in RANKS:
+            raise ValueError(f"Unknown rank {rank}")
+        with self._lock:
+            if self._versions != _versions():
+                self._versions = _versions()
+                self._daily = _load_daily()
+                self._by_rank = {}
+            if rank not in self._by_rank:
+                daily = self._daily
+                taxonomy = taxonomy_cache.get_taxonomy()
+                taxon = daily.MothName.astype(object).map(
+                    self._rank_key(rank, taxonomy)
+                )
+                taxon = taxon.rename("Taxon")
+                counts = daily.groupby([taxon, "Date"])["MothCount"].sum()
+                first_seen = daily.groupby([taxon, "MothName"], observed=True)[
+                    "Date"
+                ].min()
+                self._by_rank[rank] = counts, first_seen
+            return self._by_rank[rank]
+
+    def _key(self, rank, taxon):
+        if rank == "species":
+            return taxonomy_cache.get_taxonomy().tvk(taxon)
+        return taxon.lower()
+
+    def daily(self, rank, taxon):
+        """ Series of the total count on each date moths in taxon were recorded """
+        counts, _ = self._counts(rank)
+        try:
+            return counts.loc[self._key(rank, taxon)]
+        except KeyError:
+            return pd.Series([], dtype="int32", index=pd.DatetimeIndex([]))
+
+    def names(self, rank, taxon):
+        """ The moth names recorded in taxon, in the order they were first seen """
+        _, first_seen = self._counts(rank)
+        try:
+            names = first_seen.loc[self._key(rank, taxon)]
+        except KeyError:
+            return []
+        return names.sort_values(kind="mergesort").index.tolist()
+
+    def season_table(self, rank, taxon):
+        """ DataFrame with a row for each day of the season axis, a column of counts
+            for each year the taxon was recorded and their "Mean".
+            Empty if the taxon has never been recorded."""
+        daily = self.daily(rank, taxon)
+        if daily.empty:
+            return pd.DataFrame()
+
+        index = pd.MultiIndex.from_arrays(
+            [seasonal.year_of(daily.index), seasonal.to_base_year(daily.index)],
+            names=["Year", "Date"],
+        )
+        table = (
+            pd.Series(daily.to_numpy(), index=index)
+            .unstack("Year")
+            .fillna(0)
+            .astype(float)
+        )
+        table["Mean"] = table.mean(axis="columns")
+        return seasonal.reindex_season(table)
+
+
+taxon_ranks = TaxonRanks()
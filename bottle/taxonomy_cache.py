@@ -0,0 +1,136 @@
+""" taxonomy_cache.py
+
+The irecord_taxonomy table held in memory as a handful of indexes, so routes can
+resolve synonyms and ranks without joining against the taxonomy inside the database.
+
+    name -> TVK                 one species can have several names (common and
+    TVK -> names                scientific), they share a Taxon Version Key
+    family/subfamily/genus -> TVKs
+
+The table is small (~2,600 rows) so it is loaded once and only reloaded when the
+"taxonomy" data version changes, which update_table_moth_taxonomy bumps after
+installing a new YYYYMMDD_irecord_names.csv.
+
+History
+-------
+18 Oct 2026 - Name lookups ignore case, like the SQL they replaced
+18 Oct 2026 - Genesis
+"""
+from collections import defaultdict
+
+import data_version
+import db_pool
+
+try:
+    from app_config_local import app_config as cfg
+except ModuleNotFoundError:
+    from app_config_default import app_config as cfg
+
+RANKS = {
+    "family": "MothFamily",
+    "subfamily": "MothSubFamily",
+    "genus": "MothGenus",
+    "species": "MothSpecies",
+}
+
+
+class Taxonomy:
+    """ Indexes over the taxonomy table rows
+        (MothName, MothFamily, MothSubFamily, MothGenus, MothSpecies, TVK) """
+
+    def __init__(self, rows):
+        self.name_to_tvk = {}
+        self.folded_name_tvk = {}  # casefolded name -> TVK
+        self.tvk_names = defaultdict(list)
+        self.tvk_ranks = {}
+        # rank -> lower case taxon -> set of TVKs
+        self.rank_tvks = {rank: defaultdict(set) for rank in RANKS}
+
+        for name, family, subfamily, genus, species, tvk in rows:
+            # A missing TVK would otherwise make every such name a synonym
+            tvk = tvk or f"name:{name}"
+            self.name_to_tvk[name] = tvk
+            self.folded_name_tvk[name.casefold()] = tvk
+            self.tvk_names[tvk].append(name)
+            ranks = {
+                "family": family,
+                "subfamily": subfamily,
+                "genus": genus,
+                "species": species,
+            }
+            self.tvk_ranks.setdefault(tvk, ranks)
+            for rank, taxon in ranks.items():
+                if taxon:
+                    self.rank_tvks[rank][taxon.lower()].add(tvk)
+
+        for names in self.tvk_names.values():
+            names.sort()
+
+    def tvk(self, name):
+        """ The TVK for a moth name, or None if the name is unknown.
+            Like the SQL it replaces, the match ignores case."""
+        if not name:
+            return None
+        return self.name_to_tvk.get(name) or self.folded_name_tvk.get(name.casefold())
+
+    def synonyms(self, name):
+        """ All the names (including name) used for the same species as name """
+        tvk = self.tvk(name)
+        return list(self.tvk_names[tvk]) if tvk else []
+
+    def ranks(self, name):
+        """ Dict of family, subfamily, genus and species for a moth name """
+        return self.tvk_ranks.get(self.tvk(name), {})
+
+    def rank_of(self, name, rank):
+        """ The family, subfamily, genus or species of a moth name (or None) """
+        return self.ranks(name).get(rank)
+
+    def scientific_name(self, name):
+        """ "Genus species" for a moth name, None if either is unknown """
+        ranks = self.ranks(name)
+        if not ranks.get("genus") or not ranks.get("species"):
+            return None
+        return f"{ranks['genus']} {ranks['species']}"
+
+    def rank_map(self, rank):
+        """ Dict of every moth name to its family, subfamily, genus or species """
+        return {
+            name: self.tvk_ranks[tvk][rank] for name, tvk in self.name_to_tvk.items()
+        }
+
+    def tvks_in(self, rank, taxon):
+        """ The TVKs of every species in a family, subfamily or genus.
+            Like the SQL it replaces, the match ignores case."""
+        return self.rank_tvks[rank].get(taxon.lower(), set())
+
+    def names_in(self, rank, taxon):
+        """ Every moth name (including synonyms) in a family, subfamily or genus """
+        return sorted(
+            name for tvk in self.tvks_in(rank, taxon) for name in self.tvk_names[tvk]
+        )
+
+
+def _load_taxonomy():
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            "SELECT MothName, MothFamily, MothSubFamily, MothGenus, MothSpecies, TVK "
+            f"FROM {cfg['TAXONOMY_TABLE']};"
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+    return Taxonomy(rows)
+
+
+taxonomy_cache = data_version.VersionedCache("taxonomy", _load_taxonomy)
+
+
+def get_taxonomy():
+    """ The current Taxonomy, loaded on first use """
+    return taxonomy_cache.get()
+
+
+def invalidate():
+    """ Call after the taxonomy table has been changed. """
+    taxonomy_cache.invalidate()
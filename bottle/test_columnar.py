@@ -0,0 +1,47 @@
+"""
+test_columnar.py
+
+Tests of the typed DataFrames built straight from a cursor
+
+
+History
+-------
+
+18 Oct 2026 - Genesis
+"""
+import columnar
+
+
+class FakeCursor:
+    column_names = ("MothName", "MothCount", "Quantity")
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[0:size], self.rows[size:]
+        return batch
+
+
+def test_null_counts():
+    rows = [("Herald", 2, 2), ("Snout", None, None), ("Herald", 0, 0)]
+    df = columnar.frame_from_cursor(
+        FakeCursor(rows),
+        {"MothName": "category", "MothCount": "int32", "Quantity": "Int32"},
+        batch_size=2,
+    )
+    assert df.MothCount.tolist() == [2, 0, 0]  # NULL read as 0
+    assert str(df.Quantity.dtype) == "Int32"
+    assert df.Quantity.isna().tolist() == [False, True, False]  # NULL kept
+
+    # As filtered for the iRecord export, a NULL count is kept as it always was
+    quantity = df.Quantity
+    assert df.loc[(quantity != 0) | quantity.isna()].MothName.tolist() == [
+        "Herald",
+        "Snout",
+    ]
+
+
+def test_empty_nullable():
+    df = columnar.frame_from_cursor(FakeCursor([]), {"Quantity": "Int32"})
+    assert str(df.Quantity.dtype) == "Int32"
@@ -7,15 +7,142 @@ Initial tests to help optimise performanace
 History
 -------
 
+18 Oct 2026 - Compare decoded figures, as plotly 6 writes arrays base64 encoded
+18 Oct 2026 - Check plotly_json against plotly and benchmark the two
 25 June 2020 = Genesis
 """
+import base64
+import datetime as dt
+import json
+import timeit
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
 
 import moths_bottle as mb
+import plotly_json
+import seasonal
+
+TODAY = dt.date(2026, 10, 18)
+
+
+def season_df(years, seed=1):
+    """ Synthetic daily counts like taxon_rank.season_table(), the last year
+        stopping at TODAY """
+    rng = np.random.default_rng(seed)
+    index = seasonal.season_axis()
+    df = pd.DataFrame(
+        rng.poisson(3, (len(index), years)).astype(float),
+        index=index,
+        columns=pd.Index(range(TODAY.year - years + 1, TODAY.year + 1), name="Year"),
+    )
+    df.loc[df.index > str(seasonal.base_date(TODAY)), TODAY.year] = np.nan
+    df["Mean"] = df.mean(axis="columns")
+    return df
+
+
+def plotly_line_graph(df):
+    """ A line graph built the way moths_bottle used to, with pandas and plotly """
+    pd.options.plotting.backend = "plotly"
+    fig = df.plot()
+    fig.add_shape(
+        dict(
+            type="line",
+            x0=seasonal.base_date(TODAY),
+            y0=0,
+            x1=seasonal.base_date(TODAY),
+            y1=1,
+            yref="paper",
+            line=dict(color="Black", width=3, dash="dot"),
+        )
+    )
+    fig.layout.title = "Synthetic"
+    fig.update_layout(mb.line_layout)
+    return fig.to_json()
+
+
+def direct_line_graph(df):
+    """ The same graph written by plotly_json """
+    layout = plotly_json.merge(
+        plotly_json.express_layout(df),
+        dict(
+            shapes=[plotly_json.today_marker(seasonal.base_date(TODAY))],
+            title={"text": "Synthetic"},
+        ),
+        mb.line_layout,
+    )
+    return plotly_json.to_json(plotly_json.line_traces(df), layout)
+
+
+def plotly_bar_graph(x, y):
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=x, y=y, marker_color="#909090", name="All"))
+    fig.add_trace(go.Bar(x=x, y=y, width=0.5, marker_color="blue", name=TODAY.year))
+    fig.update_layout(barmode="overlay")
+    return fig.to_json()
+
+
+def direct_bar_graph(x, y):
+    traces = [
+        plotly_json.bar(x, y, "All", color="#909090"),
+        plotly_json.bar(x, y, TODAY.year, color="blue", width=0.5),
+    ]
+    return plotly_json.to_json(traces, dict(barmode="overlay"))
+
+
+def decoded(obj):
+    """ obj with the {"dtype", "bdata"} typed arrays plotly >= 6 writes as lists,
+        and NaN as None, as plotly_json writes them """
+    if isinstance(obj, dict):
+        if "bdata" in obj and "dtype" in obj:
+            array = np.frombuffer(base64.b64decode(obj["bdata"]), dtype=obj["dtype"])
+            if "shape" in obj:
+                array = array.reshape([int(n) for n in str(obj["shape"]).split(",")])
+            return decoded(array.tolist())
+        return {key: decoded(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [decoded(value) for value in obj]
+    if isinstance(obj, float) and np.isnan(obj):
+        return None
+    return obj
+
+
+def same_json(a, b):
+    """ Same values, types (e.g. 1 vs 1.0) included, ignoring key order and how
+        arrays are encoded """
+    return json.dumps(decoded(json.loads(a)), sort_keys=True) == json.dumps(
+        decoded(json.loads(b)), sort_keys=True
+    )
 
 
 def test_species_perf():
-    mb.get_species("Large Yellow Underwing")
+    mb.get_pspecies("Large Yellow Underwing")
+
+
+def test_plotly_json_line_graph():
+    # 2 columns (732 points) are drawn as scatter, 8 columns as scattergl
+    for years in (1, 7):
+        df = season_df(years)
+        assert same_json(direct_line_graph(df), plotly_line_graph(df))
+
+
+def test_plotly_json_bar_graph():
+    x = [dt.date(2019, mn, 1).strftime("%b") for mn in range(1, 13)]
+    y = pd.Series(np.arange(12, dtype="int64"))
+    assert same_json(direct_bar_graph(x, y), plotly_bar_graph(x, y))
+
+
+def test_plotly_json_benchmark(number=20):
+    df = season_df(7)
+    plotly_time = timeit.timeit(lambda: plotly_line_graph(df), number=number)
+    direct_time = timeit.timeit(lambda: direct_line_graph(df), number=number)
+    print(
+        f"\nLine graph: plotly {plotly_time / number * 1000:.1f}ms, "
+        f"plotly_json {direct_time / number * 1000:.1f}ms"
+    )
 
 
 if __name__ == "__main__":
+    test_plotly_json_benchmark()
     test_species_perf()
@@ -0,0 +1,191 @@
+"""
+test_journal.py
+
+Tests of the survey journal's replay, retries, dead letters and deduplication, with
+a temporary journal file and a stub apply(), of which errors it retries, and that
+it isn't opened on import
+
+
+History
+-------
+
+18 Oct 2026 - Genesis
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import journal
+import storage
+
+
+class Busy(Exception):
+    """ A stand in for the database being unavailable """
+
+
+@pytest.fixture(autouse=True)
+def no_delay(monkeypatch):
+    monkeypatch.setattr(journal, "RETRY_DELAYS", (0,))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "survey_journal.jsonl")
+
+
+def lines(path):
+    with open(path) as fin:
+        return [json.loads(line) for line in fin]
+
+
+def new_journal(path, apply, **kwargs):
+    return journal.SurveyJournal(
+        path, apply, is_transient=lambda error: isinstance(error, Busy), **kwargs
+    )
+
+
+def test_append_and_wait(path):
+    applied = []
+    survey_journal = new_journal(path, lambda entry: applied.append(entry) or "ok")
+    entry_id = survey_journal.append({"date": "2020-06-21", "records": {}})
+
+    assert survey_journal.wait(entry_id, timeout=5) == (True, "ok")
+    assert [entry["id"] for entry in applied] == [entry_id]
+    assert lines(path) == []  # All applied, so emptied
+    assert survey_journal.stats()["applied"] == 1
+
+
+def test_replay_after_restart(path):
+    entries = [{"id": str(i), "time": 0, "date": f"2020-06-2{i}"} for i in range(3)]
+    with open(path, "w") as fout:
+        for item in entries + [{"done": "0"}]:
+            fout.write(json.dumps(item) + "\n")
+        fout.write('{"id": "3", "ti')  # Cut short by a crash
+
+    done = threading.Event()
+    applied = []
+    survey_journal = new_journal(
+        path, applied.append, after_batch=lambda batch: done.set()
+    )
+    assert survey_journal.stats()["pending"] == 2
+
+    survey_journal.start()
+    assert done.wait(5)
+    assert [entry["id"] for entry in applied] == ["1", "2"]
+    assert lines(path) == []
+
+
+def test_same_sheet_applied_once(path):
+    applied = []
+    survey_journal = new_journal(path, applied.append)
+    first = survey_journal.append({"date": "2020-06-21", "records": {"Herald": 1}})
+    second = survey_journal.append({"date": "2020-06-21", "records": {"Herald": 1}})
+
+    assert survey_journal.wait(first, timeout=5)[0]
+    assert survey_journal.wait(second, timeout=5)[0]
+    assert [entry["id"] for entry in applied] == [first]
+    assert survey_journal.stats()["duplicates"] == 1
+
+
+def test_transient_error_retried(path):
+    calls = []
+
+    def apply(entry):
+        calls.append(entry["id"])
+        if len(calls) < 5:
+            raise Busy("database restarting")
+        return "ok"
+
+    survey_journal = new_journal(path, apply, max_attempts=2)
+    entry_id = survey_journal.append({"date": "2020-06-21"})
+
+    # Tried for as long as the database is busy, not just max_attempts times
+    assert survey_journal.wait(entry_id, timeout=5) == (True, "ok")
+    assert calls == [entry_id] * 5
+    assert survey_journal.stats()["retries"] == 4
+    assert survey_journal.stats()["failed"] == 0
+
+
+def test_permanent_error_dead_lettered(path):
+    calls = []
+
+    def apply(entry):
+        calls.append(entry["date"])
+        if entry["date"] == "bad":
+            raise OverflowError("Python int too large to convert to SQLite INTEGER")
+        return "ok"
+
+    survey_journal = new_journal(path, apply, max_attempts=3)
+    bad_id = survey_journal.append({"date": "bad"})
+    good_id = survey_journal.append({"date": "2020-06-21"})
+
+    # The entry behind the one failing is still applied
+    assert survey_journal.wait(good_id, timeout=5) == (True, "ok")
+    assert survey_journal.wait(bad_id, timeout=0) == (False, None)
+    assert calls == ["bad", "bad", "bad", "2020-06-21"]
+
+    (failed,) = lines(path + journal.DEAD_LETTER_SUFFIX)
+    assert (failed["id"], failed["date"]) == (bad_id, "bad")
+    assert "OverflowError" in failed["error"]
+    assert lines(path) == []
+    assert survey_journal.stats()["failed"] == 1
+
+
+def test_other_process_entries_kept(path):
+    # Two processes sharing the journal: one finishing its entries mustn't drop
+    # those the other is still applying
+    release = threading.Event()
+    ours = new_journal(path, lambda entry: "ours")
+    theirs = new_journal(path, lambda entry: release.wait(5) and "theirs")
+
+    their_id = theirs.append({"date": "2020-06-20"})
+    our_id = ours.append({"date": "2020-06-21"})
+    assert ours.wait(our_id, timeout=5) == (True, "ours")
+    assert [entry["id"] for entry in lines(path)] == [their_id]
+
+    release.set()
+    assert theirs.wait(their_id, timeout=5) == (True, "theirs")
+    assert lines(path) == []
+
+
+def test_sqlite_only_busy_is_transient(tmp_path):
+    backend = storage.SQLiteBackend()
+    db_file = str(tmp_path / "moths.db")
+    locker = sqlite3.connect(db_file, isolation_level=None)
+    locker.execute("CREATE TABLE moth_records (MothName TEXT);")
+    locker.execute("BEGIN IMMEDIATE;")
+    cnx = sqlite3.connect(db_file, timeout=0, isolation_level=None)
+
+    with pytest.raises(sqlite3.OperationalError) as locked:
+        cnx.execute("BEGIN IMMEDIATE;")
+    assert backend.is_transient(locked.value)
+
+    # Would fail however often it was retried
+    for sql in ("SELECT * FROM no_table;", "SELECT no_column FROM moth_records;"):
+        with pytest.raises(sqlite3.OperationalError) as error:
+            cnx.execute(sql)
+        assert not backend.is_transient(error.value)
+    assert not backend.is_transient(OverflowError())
+
+    # Before Python 3.11 there is only the message to go on
+    assert backend.is_transient(sqlite3.OperationalError("database is locked"))
+    assert not backend.is_transient(sqlite3.OperationalError("no such table: x"))
+    locker.rollback()
+
+
+def test_import_opens_nothing():
+    # Importing moths_bottle (as the reloader's parent process does) mustn't
+    # replay or rewrite the journal, nor tidy the graph cache
+    script = (
+        "import moths_bottle, graph_cache; "
+        "assert moths_bottle._survey_journal is None; "
+        "assert graph_cache._graphs is None"
+    )
+    subprocess.run(
+        [sys.executable, "-c", script], cwd=os.path.dirname(__file__), check=True
+    )
@@ -0,0 +1,401 @@
+"""
+test_survey.py
+
+Tests of how a submitted survey sheet is merged and written to moth_records
+
+
+History
+-------
+
+18 Oct 2026 - Test the conflicts of a queued survey are kept for its sheet
+18 Oct 2026 - Test records are checked, and each journal entry is saved once
+18 Oct 2026 - Test merging sheets, and the 409 for species in conflict
+18 Oct 2026 - Genesis
+"""
+import contextlib
+import io
+import json
+import urllib.parse
+
+import bottle
+import pytest
+
+import moths_bottle as mb
+
+DATE = "2026-10-18"
+
+
+def night(*rows):
+    """ Stored rows (Id, MothName, MothCount, Location, Recorder, Trap) """
+    return [(row_id, *row) for row_id, row in enumerate(rows, 1)]
+
+
+def test_night_changes_unchanged():
+    stored = night(("Angle Shades", 2, "Garden", "Me", "MV"))
+    wanted = {"Angle Shades": (2, "Garden", "Me", "MV")}
+    assert mb._night_changes(DATE, stored, wanted) == ([], [], [], False, set())
+
+
+def test_night_changes_changed():
+    stored = night(
+        ("Angle Shades", 2, "Garden", "Me", "MV"), ("Herald", 1, "Garden", "Me", "MV")
+    )
+    wanted = {
+        "Angle Shades": (3, "Garden", "Me", "MV"),
+        "Herald": (1, "Garden", "Me", "Actinic"),
+    }
+    inserts, updates, deletes, needs_marker, changed = mb._night_changes(
+        DATE, stored, wanted
+    )
+    assert updates == [(3, "Garden", "Me", "MV", 1), (1, "Garden", "Me", "Actinic", 2)]
+    assert (inserts, deletes, needs_marker) == ([], [], False)
+    assert changed == {"Angle Shades", "Herald"}
+
+
+def test_night_changes_added_and_removed():
+    stored = night(
+        ("Angle Shades", 2, "Garden", "Me", "MV"), ("Herald", 1, "Garden", "Me", "MV")
+    )
+    wanted = {
+        "Angle Shades": (2, "Garden", "Me", "MV"),
+        "O'Brien's \"Pug\"": (4, "Garden", "Me", "MV"),
+    }
+    inserts, updates, deletes, needs_marker, changed = mb._night_changes(
+        DATE, stored, wanted
+    )
+    assert inserts == [(DATE, "O'Brien's \"Pug\"", 4, "Garden", "Me", "MV")]
+    assert deletes == [(2,)]
+    assert (updates, needs_marker) == ([], False)
+    assert changed == {"Herald", "O'Brien's \"Pug\""}
+
+
+def test_night_changes_duplicates_folded():
+    stored = night(
+        ("Herald", 1, "Garden", "Me", "MV"), ("Herald", 5, "Garden", "Me", "MV")
+    )
+    wanted = {"Herald": (1, "Garden", "Me", "MV")}
+    inserts, updates, deletes, needs_marker, changed = mb._night_changes(
+        DATE, stored, wanted
+    )
+    assert (inserts, updates, deletes) == ([], [], [(2,)])
+    assert changed == {"Herald"}
+
+
+def test_night_changes_empty_night_marker():
+    # Nothing caught: the species go and one unnamed row records the trap was run
+    stored = night(("Herald", 1, "Garden", "Me", "MV"))
+    inserts, updates, deletes, needs_marker, changed = mb._night_changes(
+        DATE, stored, {}
+    )
+    assert (inserts, updates, deletes, needs_marker) == ([], [], [(1,)], True)
+    assert changed == {"Herald"}
+
+    # Already marked, so nothing to do, and a second marker is removed
+    stored = night((None, 0, None, None, None), (None, 0, None, None, None))
+    assert mb._night_changes(DATE, stored, {}) == ([], [], [(2,)], False, set())
+
+
+def test_night_changes_marker_replaced():
+    stored = night((None, 0, None, None, None))
+    wanted = {"Herald": (1, "Garden", "Me", "MV")}
+    inserts, updates, deletes, needs_marker, changed = mb._night_changes(
+        DATE, stored, wanted
+    )
+    assert inserts == [(DATE, "Herald", 1, "Garden", "Me", "MV")]
+    assert (updates, deletes, needs_marker) == ([], [(1,)], False)
+    assert changed == {"Herald"}
+
+
+def test_record_version():
+    assert mb.record_version(None) == ""
+    assert mb.record_version((2, "Garden", "Me", "MV")) == mb.record_version(
+        [2, "Garden", "Me", "MV"]
+    )
+    assert mb.record_version((2, "Garden", "Me", "MV")) != mb.record_version(
+        (3, "Garden", "Me", "MV")
+    )
+
+
+def test_merge_night_clean():
+    # Another sheet added the Herald since this one loaded, which this sheet
+    # never showed, so it is kept alongside this sheet's changes
+    angle, herald = (2, "Garden", "Me", "MV"), (1, "Garden", "You", "MV")
+    stored = night(("Angle Shades", *angle), ("Herald", *herald))
+    wanted = {"Angle Shades": (5, "Garden", "Me", "MV"), "Snout": angle}
+    based_on = {"Angle Shades": mb.record_version(angle), "Snout": ""}
+    merged, conflicts = mb._merge_night(stored, wanted, based_on)
+    assert merged == {
+        "Angle Shades": (5, "Garden", "Me", "MV"),
+        "Herald": herald,
+        "Snout": angle,
+    }
+    assert conflicts == []
+
+
+def test_merge_night_removed():
+    angle = (2, "Garden", "Me", "MV")
+    stored = night(("Angle Shades", *angle))
+    merged, conflicts = mb._merge_night(
+        stored, {}, {"Angle Shades": mb.record_version(angle)}
+    )
+    assert (merged, conflicts) == ({}, [])
+
+
+def test_merge_night_conflict():
+    loaded, theirs = (2, "Garden", "Me", "MV"), (4, "Garden", "You", "MV")
+    stored = night(("Angle Shades", *theirs))
+    wanted = {"Angle Shades": (3, "Garden", "Me", "MV")}
+    merged, conflicts = mb._merge_night(
+        stored, wanted, {"Angle Shades": mb.record_version(loaded)}
+    )
+    assert merged == {"Angle Shades": theirs}
+    assert conflicts == [
+        {
+            "species": "Angle Shades",
+            "yours": dict(zip(mb.RECORD_FIELDS, (3, "Garden", "Me", "MV"))),
+            "stored": dict(zip(mb.RECORD_FIELDS, theirs)),
+        }
+    ]
+
+    # Both sheets making the same change isn't a conflict
+    merged, conflicts = mb._merge_night(
+        stored, {"Angle Shades": theirs}, {"Angle Shades": mb.record_version(loaded)}
+    )
+    assert (merged, conflicts) == ({"Angle Shades": theirs}, [])
+
+
+def test_merge_night_conflict_and_merge():
+    loaded, theirs = (2, "Garden", "Me", "MV"), (4, "Garden", "You", "MV")
+    herald = (1, "Garden", "Me", "MV")
+    stored = night(("Angle Shades", *theirs), ("Herald", *herald))
+    wanted = {"Angle Shades": (3, "Garden", "Me", "MV"), "Snout": herald}
+    based_on = {
+        "Angle Shades": mb.record_version(loaded),
+        "Herald": mb.record_version(herald),
+        "Snout": "",
+    }
+    merged, conflicts = mb._merge_night(stored, wanted, based_on)
+    # The Herald was removed and the Snout added, the Angle Shades left as stored
+    assert merged == {"Angle Shades": theirs, "Snout": herald}
+    assert [conflict["species"] for conflict in conflicts] == ["Angle Shades"]
+
+
+class FakeCursor:
+    """ Serves stored rows to the SELECT of the night, and applied (entry ids) to
+        that of survey_applied, recording the writes """
+
+    def __init__(self, stored, applied=()):
+        self.stored = stored
+        self.applied = applied
+        self.writes = []
+
+    def execute(self, sql, params=()):
+        if sql.startswith("SELECT"):
+            self.rows = self.applied if mb.APPLIED_TABLE in sql else self.stored
+        else:
+            self.writes.append((sql.split()[0], [params]))
+
+    def executemany(self, sql, rows):
+        self.writes.append((sql.split()[0], rows))
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.calls = []
+
+    def start_transaction(self):
+        self.calls.append("start_transaction")
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+    def cursor(self):
+        return self.cursor_
+
+
+@contextlib.contextmanager
+def connection(cnx):
+    yield cnx
+
+
+def test_update_moth_database_once_per_entry(monkeypatch, tmp_path):
+    monkeypatch.setitem(mb.cfg, "RECORDS_PATH", str(tmp_path) + "/")
+    monkeypatch.setattr(mb.rollups, "update_month", lambda cursor, date: None)
+    records = {
+        "Herald": {"count": 1, "location": "Garden", "recorder": "Me", "trap": "MV"}
+    }
+
+    # The entry id is saved along with the records
+    cnx, cursor = FakeConnection(), FakeCursor(night())
+    touched, changed, conflicts = mb.update_moth_database(
+        cnx, cursor, DATE, records, entry_id="abc", submitted=1.5
+    )
+    assert touched == {"inserted": 1, "updated": 0, "deleted": 0}
+    assert cursor.writes == [
+        ("INSERT", [(DATE, "Herald", 1, "Garden", "Me", "MV")]),
+        ("INSERT", [("abc", DATE, 1.5, None)]),
+    ]
+    assert cnx.calls == ["start_transaction", "commit"]
+    version = mb.data_version.version("records")
+    assert version > 0  # The change is seen by every process
+
+    # Replayed, as the server stopped before the journal marked it done
+    cnx, cursor = FakeConnection(), FakeCursor(night(), applied=[("abc",)])
+    touched, changed, conflicts = mb.update_moth_database(
+        cnx, cursor, DATE, records, entry_id="abc"
+    )
+    assert touched == {"inserted": 0, "updated": 0, "deleted": 0}
+    assert (changed, conflicts, cursor.writes) == (set(), [], [])
+    assert cnx.calls == ["start_transaction", "rollback"]
+    assert mb.data_version.version("records") == version
+
+
+def test_queued_conflicts_kept_for_the_sheet(monkeypatch, tmp_path):
+    # A queued survey has no one waiting for its 409, so its conflicts are stored
+    # and shown when the night's sheet is next opened
+    monkeypatch.setitem(mb.cfg, "RECORDS_PATH", str(tmp_path) + "/")
+    monkeypatch.setattr(mb.rollups, "update_month", lambda cursor, date: None)
+    loaded, theirs = (2, "Garden", "Me", "MV"), (4, "Garden", "You", "MV")
+    records = {"Angle_Shades": dict(zip(mb.RECORD_FIELDS, (3, "Garden", "Me", "MV")))}
+    cnx, cursor = FakeConnection(), FakeCursor(night(("Angle Shades", *theirs)))
+    touched, changed, conflicts = mb.update_moth_database(
+        cnx,
+        cursor,
+        DATE,
+        records,
+        {"Angle Shades": mb.record_version(loaded)},
+        entry_id="abc",
+        submitted=1.5,
+    )
+    ((_, [(_, _, _, stored)]),) = cursor.writes
+    assert json.loads(stored) == conflicts
+    assert [conflict["species"] for conflict in conflicts] == ["Angle Shades"]
+
+    cnx.cursor_ = FakeCursor(night(), applied=[(stored,)])
+    monkeypatch.setattr(mb.db_pool, "connection", lambda: connection(cnx))
+    assert mb.survey_conflicts(DATE) == conflicts
+
+    # Until a later submission is saved without any
+    cnx.cursor_ = FakeCursor(night(), applied=[(None,)])
+    assert mb.survey_conflicts(DATE) == []
+
+
+class FakeJournal:
+    """ Applies each entry as soon as it is appended """
+
+    def __init__(self, apply):
+        self.apply = apply
+        self.results = {}
+
+    def append(self, entry):
+        self.results["1"] = self.apply(entry)
+        return "1"
+
+    def wait(self, entry_id, timeout):
+        return True, self.results.pop(entry_id)
+
+
+def submit(sheet):
+    """ Post sheet ({form field: value}) to survey_handler, returning its response
+        status and (template name, template arguments) """
+    body = urllib.parse.urlencode(sheet).encode()
+    bottle.request.bind(
+        {
+            "REQUEST_METHOD": "POST",
+            "CONTENT_TYPE": "application/x-www-form-urlencoded",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BytesIO(body),
+        }
+    )
+    bottle.response.bind()
+    rsp = mb.survey_handler()
+    return bottle.response.status_code, rsp
+
+
+def test_survey_handler_conflict(monkeypatch, tmp_path):
+    loaded, theirs = (2, "Garden", "Me", "MV"), (4, "Garden", "You", "MV")
+    cnx, cursor = FakeConnection(), FakeCursor(night(("Angle Shades", *theirs)))
+    monkeypatch.setitem(mb.cfg, "RECORDS_PATH", str(tmp_path) + "/")
+    monkeypatch.setattr(mb.rollups, "update_month", lambda cursor, date: None)
+    monkeypatch.setattr(
+        mb,
+        "_survey_journal",
+        FakeJournal(
+            lambda entry: mb.update_moth_database(
+                cnx, cursor, entry["date"], entry["records"], entry["based_on"]
+            )[2]
+        ),
+    )
+    monkeypatch.setattr(
+        mb, "load_survey_sheet", lambda date, conflicts: {"conflicts": conflicts}
+    )
+    monkeypatch.setattr(mb, "template", lambda name, **kwargs: (name, kwargs))
+
+    sheet = {
+        "dash_date_str": DATE,
+        "merge": "1",
+        "Angle_Shades": json.dumps(
+            {
+                "count": 3,
+                "location": "Garden",
+                "recorder": "Me",
+                "trap": "MV",
+                "version": mb.record_version(loaded),
+            }
+        ),
+        "Snout": json.dumps(
+            {"count": 1, "location": "", "recorder": "", "trap": "", "version": ""}
+        ),
+    }
+    status, (name, kwargs) = submit(sheet)
+
+    assert status == 409
+    assert name == "vue_survey.tpl"
+    assert [conflict["species"] for conflict in kwargs["conflicts"]] == ["Angle Shades"]
+    # The Snout is saved, with the sheet's defaults, in the same transaction
+    assert cursor.writes == [
+        ("INSERT", [(DATE, "Snout", 1, "NULL", "NULL", "NULL")]),
+    ]
+    assert cnx.calls == ["start_transaction", "commit"]
+
+
+def test_record_problem():
+    record = {"count": 3, "location": "Garden", "recorder": "Me", "trap": "MV"}
+    assert mb.record_problem("Herald", record) is None
+    assert "out of range" in mb.record_problem(
+        "Herald", dict(record, count=mb.MAX_COUNT + 1)
+    )
+    assert "name" in mb.record_problem("H" * 51, record)
+    assert "location" in mb.record_problem("Herald", dict(record, location="L" * 31))
+    assert "isn't text" in mb.record_problem("Herald", dict(record, trap=7))
+
+
+def test_survey_handler_refuses_bad_records(monkeypatch):
+    # Refused before being journalled, where it would fail to save for ever
+    monkeypatch.setattr(mb, "_survey_journal", FakeJournal(pytest.fail))
+    monkeypatch.setattr(mb, "template", lambda name, **kwargs: (name, kwargs))
+
+    sheet = {
+        "dash_date_str": DATE,
+        "Herald": json.dumps(
+            {"count": mb.MAX_COUNT + 1, "location": "", "recorder": "", "trap": ""}
+        ),
+        "Snout": json.dumps({"count": 1, "location": "", "recorder": "", "trap": ""}),
+    }
+    status, (name, kwargs) = submit(sheet)
+
+    assert status == 400
+    assert name == "survey_rejected.tpl"
+    assert kwargs["problems"] == ["Herald: a count of 2147483648 is out of range"]
@@ -9,6 +9,18 @@ will be (re)written.
 
 History
 -------
+18 Oct 2026 - Schema 3 stores each saved submission's time and conflicts
+18 Oct 2026 - Schema 2 adds survey_applied, the ids of the saved survey submissions
+18 Oct 2026 - One loader, inserting in a transaction, for new and replaced tables
+18 Oct 2026 - New taxonomy built in a shadow table and swapped in whole
+18 Oct 2026 - Records are remapped with one UPDATE, and unmapped names reported
+18 Oct 2026 - Taxonomy loaded with batched executemany in one transaction
+18 Oct 2026 - Schema updates are versioned and skipped once applied
+18 Oct 2026 - Creates and maintains the rollup_month totals table
+18 Oct 2026 - Installing a new taxonomy reloads the taxonomy_cache
+18 Oct 2026 - Column defaults are served from schema_cache
+18 Oct 2026 - MariaDB only SQL moved behind the storage backend (adds SQLite)
+18 Oct 2026 - Database connections are borrowed from the shared pool in db_pool
 14 July 2020 - Added code to add the recorder, location and trap tables
 26 June 2020 - Added indexes
 20 June 2020 - Made sure list going into common_names.js is sorted.
@@ -16,20 +28,22 @@ History
 
 """
 import pandas as pd
-import mysql.connector as mariadb
 import os
 import datetime as dt
 import glob
+import time
+
+import data_version
+import db_pool
+import rollups
+import schema_cache
+import storage
+import taxonomy_cache
 
 # Can't call this twice without messing things up.
 # TODO: get rid of the global variables and
 # pass a reference to sql_config and app_config
 # os.chdir(os.path.dirname(os.path.abspath(__file__)))
-try:
-    from sql_config_local import sql_config
-except ModuleNotFoundError:
-    from sql_config_default import sql_config
-
 try:
     from app_config_local import app_config as cfg
 except ModuleNotFoundError:
@@ -38,6 +52,22 @@ except ModuleNotFoundError:
 
 cfg["IRECORD_TABLE_DATE_FILE"] = "last_irecord_table_update.log"
 
+# Bump SCHEMA_VERSION whenever _apply_schema() changes, so it is run again
+SCHEMA_VERSION = 3
+SCHEMA_TABLE = "schema_version"
+APPLIED_TABLE = "survey_applied"  # Ids of the journalled surveys saved
+
+INSERT_BATCH = 1000  # Rows per executemany, well inside max_allowed_packet
+REMAP_TABLE = "name_remap"  # Old to new names, while update_records runs
+TAXONOMY_COLUMNS = [
+    "MothName",
+    "MothFamily",
+    "MothSubFamily",
+    "MothGenus",
+    "MothSpecies",
+    "TVK",
+]
+
 
 def update_mothnames():
     """ Updates /static/common_names.js
@@ -90,55 +120,105 @@ def update_check():
     return newest_table_name
 
 
+def taxonomy_rows(names_df):
+    """ The rows of the taxonomy table for names_df (a names csv): sorted by
+        MothName, with each species only listed by its common name followed by a
+        row for its scientific name, "MothGenus MothSpecies". """
+    names_df = names_df.sort_values("MothName").reset_index(drop=True)
+    taxon = names_df.MothGenus + " " + names_df.MothSpecies
+    common = names_df.MothName != taxon
+    # Avoid duplicating scientific name entries
+    add = common & ~taxon.where(common).duplicated()
+    synonyms_df = names_df[add].assign(MothName=taxon[add])
+    return pd.concat([names_df, synonyms_df]).sort_index(kind="mergesort")
+
+
+def _insert_rows(cursor, tablename, rows_df):
+    """ Insert rows_df into tablename, INSERT_BATCH rows per executemany.
+        Returns the number of rows. """
+    start = time.perf_counter()
+    cols = ",".join(rows_df.columns)
+    subs = ",".join(["%s"] * len(rows_df.columns))
+    rows = list(rows_df.itertuples(index=False, name=None))
+    for first in range(0, len(rows), INSERT_BATCH):
+        cursor.executemany(
+            f"INSERT INTO {tablename} ({cols}) VALUES ({subs})",
+            rows[first : first + INSERT_BATCH],
+        )
+
+    seconds = time.perf_counter() - start
+    print(
+        f"Loaded {len(rows)} rows into {tablename} in {seconds:.2f}s "
+        f"({len(rows) / seconds:.0f} rows/s)"
+    )
+    return len(rows)
+
+
+def load_taxonomy(cnx, cursor, tablename, rows_df):
+    """ (Re)create tablename holding rows_df (see taxonomy_rows()), with its
+        indexes, and check it. The rows are inserted in one transaction, or in the
+        caller's if it has one open (as SQLite's replace_table does).
+        Raises ValueError if the table doesn't hold them all, else returns the count.
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {tablename};")
+    command = (
+        f"CREATE TABLE {tablename} ({storage.get_backend().AUTO_ID}, "
+        f"{' VARCHAR(50) DEFAULT NULL, '.join(rows_df.columns)}"
+        f" VARCHAR(50) DEFAULT NULL"
+        f");"
+    )
+    print(command)
+    cursor.execute(command)
+
+    own_transaction = not cnx.in_transaction
+    if own_transaction:
+        cnx.start_transaction()
+    _insert_rows(cursor, tablename, rows_df)
+    if own_transaction:
+        cnx.commit()
+    _index_taxonomy(cursor, tablename)
+
+    cursor.execute(f"SELECT COUNT(*), COUNT(DISTINCT TVK) FROM {tablename};")
+    count, tvks = cursor.fetchone()
+    if count != len(rows_df) or not tvks:
+        raise ValueError(f"{tablename} has {count} rows ({tvks} TVKs)")
+    return count
+
+
 def update_table(tablename, filename):
-    cnx = mariadb.connect(**sql_config)
-    cursor = cnx.cursor()
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        rv = _update_table(cnx, cursor, tablename, filename)
+        cursor.close()
+    return rv
+
+
+def _update_table(cnx, cursor, tablename, filename):
+    """ Replace tablename with the names in filename. The new table is built and
+        checked out of sight and swapped in whole, so the server can carry on
+        reading the old one meanwhile. """
     rv = True
 
     try:
 
         names_df = pd.read_csv(filename).fillna("")
-        names_df.sort_values("MothName", inplace=True)
+        missing = set(TAXONOMY_COLUMNS) - set(names_df.columns)
+        if missing:
+            raise ValueError(f"{filename} has no {', '.join(sorted(missing))}")
+        rows_df = taxonomy_rows(names_df)
 
         # Create and populate moth_taxonomy
-        cursor.execute(f"DROP TABLE IF EXISTS {tablename};")
-        command = (
-            f"CREATE TABLE {tablename} (Id INT AUTO_INCREMENT PRIMARY KEY, "
-            f"{' VARCHAR(50) DEFAULT NULL, '.join(names_df.columns)}"
-            f" VARCHAR(50) DEFAULT NULL"
-            f");"
+        storage.get_backend().replace_table(
+            cnx,
+            cursor,
+            tablename,
+            lambda name: load_taxonomy(cnx, cursor, name, rows_df),
         )
-        print(command)
-        cursor.execute(command)
-
-        cols = ",".join(names_df.columns)
-        subs = ",".join(["%s"] * len(names_df.columns))
-        print(cols)
-        print(names_df.columns)
-        mgi = list(names_df.columns).index("MothGenus")
-        msi = list(names_df.columns).index("MothSpecies")
-        mni = list(names_df.columns).index("MothName")
-        print(mgi, msi)
-        # Avoid duplicating scientific name entries
-        taxons_added = set()
-        for _, *row in names_df.itertuples():
-            cursor.execute(
-                f"INSERT INTO {tablename} ({cols}) VALUES ({subs});", tuple(row)
-            )
-            taxon = f"{row[mgi]} {row[msi]}"
-            if row[mni] != taxon and taxon not in taxons_added:
-                # print((taxon, *row[1:]))
-                cursor.execute(
-                    f"INSERT INTO {tablename} ({cols}) VALUES ({subs});",
-                    (taxon, *row[1:]),
-                )
-                taxons_added.add(taxon)
-
-    except ModuleNotFoundError:
-        rv = False
+        taxonomy_cache.invalidate()
 
-    cnx.close()
-    cursor.close()
+    except ValueError as e:
+        print(f"{tablename} not updated: {e}")
+        rv = False
 
     return rv
 
@@ -146,17 +226,15 @@ def update_table(tablename, filename):
 def get_table(sql_query):
     """ Creates a pandas DataFrame from a SQL Query"""
 
-    # Establish a connection to the SQL server
-    # print(sql_config)
-    cnx = mariadb.connect(**sql_config)
-    cursor = cnx.cursor()
+    # Borrow a connection to the SQL server from the pool
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
 
-    cursor.execute(sql_query)
-    data_list = [list(c) for c in cursor]
-    count_df = pd.DataFrame(data_list, columns=list(cursor.column_names))
+        cursor.execute(sql_query)
+        data_list = [list(c) for c in cursor]
+        count_df = pd.DataFrame(data_list, columns=list(cursor.column_names))
 
-    cursor.close()
-    cnx.close()
+        cursor.close()
     return count_df
 
 
@@ -166,93 +244,169 @@ def update_records(mapfile_name):
         e.g. Pugs agg. ignore these - despite causing issues later
     """
     # load map
-    moth_map = pd.read_csv(mapfile_name, index_col="ukmoths", squeeze=True).to_dict()
-
-    # Get list of names in records
-    unique_names = get_table("SELECT MothName FROM moth_records GROUP BY MothName;")
+    moth_map = (
+        pd.read_csv(mapfile_name, index_col="ukmoths")["irecord"].dropna().to_dict()
+    )
 
-    cnx = mariadb.connect(**sql_config)
-    cursor = cnx.cursor()
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        renamed, unmapped = _update_records(cnx, cursor, moth_map)
+        cursor.close()
 
-    for mname in unique_names["MothName"]:
-        if mname is None:
-            continue
-        # If name doesn't exist in latest taxonomy table, check for a map
-        test_species = get_table(
-            f'SELECT MothName FROM {cfg["TAXONOMY_TABLE"]} WHERE MothName="{mname}";'
-        )
-        if test_species.empty:
-            print(f"Unknown name: {mname} ==> {moth_map.get(mname, mname)}", end="")
-            if mname in moth_map:
-                print()
-                cursor.execute(
-                    f"""UPDATE moth_records SET MothName = "{moth_map[mname]}"
-                        WHERE MothName = "{mname}";"""
-                )
-            else:
-                print("\u001b[31m X \u001b[0m")
-
-    cursor.close()
-    cnx.close()
+    print(f"Renamed {renamed} records")
+    if unmapped:
+        print(f"{len(unmapped)} names are in neither the taxonomy nor the map:")
+        for mname, count in unmapped.items():
+            print(f"    {mname} ({count} records)\u001b[31m X \u001b[0m")
     return True
 
 
+def unknown_names(cursor):
+    """ dict of the names in moth_records missing from the taxonomy table, to the
+        number of records using them """
+    cursor.execute(
+        f"""SELECT r.MothName, COUNT(*) FROM moth_records r
+            LEFT JOIN {cfg["TAXONOMY_TABLE"]} t ON t.MothName = r.MothName
+            WHERE r.MothName IS NOT NULL AND t.MothName IS NULL
+            GROUP BY r.MothName ORDER BY r.MothName;"""
+    )
+    return dict(cursor.fetchall())
+
+
+def _update_records(cnx, cursor, moth_map):
+    """ Remap the names in moth_records missing from the taxonomy table using
+        moth_map, with one UPDATE in a transaction.
+        Returns (records renamed, {unmapped name: records}) """
+    unknown = unknown_names(cursor)
+    remap = [(mname, moth_map[mname]) for mname in unknown if mname in moth_map]
+    unmapped = {m: count for m, count in unknown.items() if m not in moth_map}
+    if not remap:
+        return 0, unmapped
+
+    for mname, new_name in remap:
+        print(f"Unknown name: {mname} ==> {new_name}")
+    cursor.execute(f"DROP TABLE IF EXISTS {REMAP_TABLE};")
+    cursor.execute(
+        f"CREATE TABLE {REMAP_TABLE} "
+        "(OldName VARCHAR(50) PRIMARY KEY, NewName VARCHAR(50) NOT NULL);"
+    )
+    cnx.start_transaction()
+    cursor.executemany(
+        f"INSERT INTO {REMAP_TABLE} (OldName, NewName) VALUES (%s, %s)", remap
+    )
+    cursor.execute(
+        f"""UPDATE moth_records SET MothName = (
+                SELECT NewName FROM {REMAP_TABLE} WHERE OldName = moth_records.MothName
+            )
+            WHERE MothName IN (SELECT OldName FROM {REMAP_TABLE});"""
+    )
+    renamed = cursor.rowcount
+    cnx.commit()
+    cursor.execute(f"DROP TABLE {REMAP_TABLE};")
+    return renamed, unmapped
+
+
 def set_column_default(col_name, def_value):
     """ Encapsulates the methods for updating the column defaults
     """
 
+    new_default = def_value
     if def_value in ["NULL", None, ""]:  # Seems hacky to me but "NULL" won't work
         print("Really setting defauly to NULL")
-        get_table(f"""ALTER TABLE moth_records ALTER {col_name} SET DEFAULT NULL;""")
-    else:
-        get_table(
-            f"""ALTER TABLE moth_records ALTER {col_name} SET DEFAULT "{def_value}";"""
+        new_default = None
+
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        storage.get_backend().set_column_default(
+            cursor, "moth_records", col_name, new_default
         )
+        cursor.close()
 
     # If any entries are NULL set to default
     get_table(
         f'UPDATE moth_records SET {col_name}="{def_value}"'
         f' WHERE  {col_name} IN (NULL, "NULL", "", "None");'
     )
+    schema_cache.invalidate()
+
+
+def get_column_defaults():
+    """ Returns a dict of the moth_records column defaults """
+    return dict(schema_cache.column_defaults())
 
 
 def get_column_default(col_name):
     """ Encapsulates the retrieval of a column default value
     """
-    records_description = get_table("DESCRIBE moth_records;").set_index("Field")
+    return get_column_defaults().get(col_name)
 
-    try:
-        rv = records_description.loc[col_name]["Default"]
-    except KeyError:
-        rv = None
-    return rv
 
+def _index_taxonomy(cursor, tablename):
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS tax_MothName ON {tablename}(MothName);")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS tax_TVK ON {tablename}(TVK);")
 
-def update_table_moth_taxonomy():
-    # TODO Turn off auto commit so we can roll back if issues are found
 
-    # TODO Move to a function to ensure the databases are up to date
-    get_table(
-        f"CREATE INDEX IF NOT EXISTS tax_MothName ON {cfg['TAXONOMY_TABLE']}(MothName);"
-    )
-    get_table(f"CREATE INDEX IF NOT EXISTS tax_TVK ON {cfg['TAXONOMY_TABLE']}(TVK);")
-    get_table(f"CREATE INDEX IF NOT EXISTS rec_MothName ON moth_records(MothName);")
-    get_table(f"CREATE INDEX IF NOT EXISTS rec_Date ON moth_records(Date);")
+def _apply_schema(cursor):
+    """ Indexes, columns and tables added since the database was created """
+    _index_taxonomy(cursor, cfg["TAXONOMY_TABLE"])
+    cursor.execute("CREATE INDEX IF NOT EXISTS rec_MothName ON moth_records(MothName);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS rec_Date ON moth_records(Date);")
 
     # Ensure additional columns exist - don't set default.
     # If no value set, then it will get automatically updated when the first
     # default is set.
-    get_table("ALTER TABLE moth_records ADD COLUMN IF NOT EXISTS" " Recorder CHAR(30);")
-    get_table("ALTER TABLE moth_records ADD COLUMN IF NOT EXISTS" " Trap CHAR(30);")
-    get_table("ALTER TABLE moth_records ADD COLUMN IF NOT EXISTS" " Location CHAR(30);")
+    for column in ["Recorder", "Trap", "Location"]:
+        storage.get_backend().add_column(cursor, "moth_records", column, "CHAR(30)")
+    rollups.ensure(cursor)
 
     # Create supplimentaty tables for Recorders, Traps and Locations.
-    get_table("CREATE TABLE IF NOT EXISTS recorders_list (Recorder CHAR(30) NOT NULL);")
-    get_table("CREATE TABLE IF NOT EXISTS traps_list (Trap CHAR(30) NOT NULL);")
-    get_table(
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS recorders_list (Recorder CHAR(30) NOT NULL);"
+    )
+    cursor.execute("CREATE TABLE IF NOT EXISTS traps_list (Trap CHAR(30) NOT NULL);")
+    cursor.execute(
         "CREATE TABLE IF NOT EXISTS locations_list "
         "(Name CHAR(30) NOT NULL, OSGB_Grid CHAR(15));"
     )
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {APPLIED_TABLE} "
+        "(EntryId CHAR(32) NOT NULL PRIMARY KEY, Date DATE);"
+    )
+    # When each was submitted, and the species it couldn't save, as JSON
+    storage.get_backend().add_column(cursor, APPLIED_TABLE, "Submitted", "DOUBLE")
+    storage.get_backend().add_column(cursor, APPLIED_TABLE, "Conflicts", "TEXT")
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS applied_Date ON {APPLIED_TABLE}(Date);"
+    )
+
+
+def ensure_schema():
+    """ Bring the database up to SCHEMA_VERSION, using one connection.
+        Returns False, having only read the version, if it already was."""
+    with db_pool.connection() as cnx:
+        cursor = cnx.cursor()
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} (Version INT NOT NULL);"
+        )
+        cursor.execute(f"SELECT MAX(Version) FROM {SCHEMA_TABLE};")
+        (applied,) = cursor.fetchone()
+        if applied is not None and applied >= SCHEMA_VERSION:
+            cursor.close()
+            return False
+
+        print(f"Updating database schema {applied} ==> {SCHEMA_VERSION}")
+        _apply_schema(cursor)
+        cursor.execute(f"DELETE FROM {SCHEMA_TABLE};")
+        cursor.execute(
+            f"INSERT INTO {SCHEMA_TABLE} (Version) VALUES (%s);", (SCHEMA_VERSION,)
+        )
+        cursor.close()
+    return True
+
+
+def update_table_moth_taxonomy():
+    # TODO Turn off auto commit so we can roll back if issues are found
+    ensure_schema()
 
     # Main function starts here
     #
@@ -272,6 +426,8 @@ def update_table_moth_taxonomy():
             if not update_records(mapfile_name):
                 print(f"Failed update_records {mapfile_name}")
                 return
+            rollups.rebuild()  # Records may have been renamed
+            data_version.bump("records")
             with open(cfg["IRECORD_TABLE_DATE_FILE"], "w"):
                 pass  # Touch the file to store update
         update_mothnames()
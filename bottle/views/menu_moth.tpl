@@ -11,6 +11,7 @@
 <li><a href="/latest">Latest Catches</a></li>
 <li><a href="/species">Species Summary</a></li>
 <li><a href="/genus">Genus Summary</a></li>
+<li><a href="/subfamily">Subfamily Summary</a></li>
 <li><a href="/family">Family Summary</a></li>
 <li><a href="/summary">Summary</a></li>
 <li><a href="/export">Export</a></li>
@@ -0,0 +1,16 @@
+<!DOCTYPE html>
+<html>
+<head>
+    <link rel="stylesheet" type="text/css" href="/static/mothmenu.css">
+</head>
+
+<body>
+    % include("menu_moth.tpl")
+<h1>Survey received</h1>
+<p>The database is busy, so the survey for {{dash_date_str}} has been kept on the
+server and will be saved shortly.</p>
+<p><a href="/survey/{{dash_date_str}}">Back to {{dash_date_str}}</a></p>
+</body>
+
+
+</html>
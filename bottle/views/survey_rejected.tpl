@@ -0,0 +1,20 @@
+<!DOCTYPE html>
+<html>
+<head>
+    <link rel="stylesheet" type="text/css" href="/static/mothmenu.css">
+</head>
+
+<body>
+    % include("menu_moth.tpl")
+<h1>Survey not saved</h1>
+<p>The survey for {{dash_date_str}} can't be saved as:</p>
+<ul>
+% for problem in problems:
+    <li>{{problem}}</li>
+% end
+</ul>
+<p>Go back to the survey sheet to correct it and submit it again.</p>
+</body>
+
+
+</html>
@@ -10,9 +10,9 @@
 
 <body>
 % include("menu_moth.tpl")
-<h1>{{genus}}</h1>
+<h1>{{taxon}}</h1>
 
-<div style="position: relative;" id="genusGraph">
+<div style="position: relative;" id="taxonGraph">
 </div>
 
 <div>
@@ -31,6 +31,6 @@ for s in species:
 </body>
 
 <script>
-    Plotly.newPlot('genusGraph', {{!gg}});
+    Plotly.newPlot('taxonGraph', {{!graph}});
 </script>
 </html>
@@ -2,7 +2,6 @@
 <html>
 <head>
     <script src="https://cdn.jsdelivr.net/npm/vue@2.7.0"></script>
-    <script src="/static/manifest.js"></script>
     <script src="/static/common_names.js?"></script>
     <link rel="stylesheet" type="text/css" href="/static/vue_survey.css">
     <link rel="stylesheet" type="text/css" href="/static/mothmenu.css">
@@ -300,6 +299,13 @@
               <input class="survey_date"  type="date" name="dash_date_str" v-bind:max="get_today_str" v-model:value="this_date" required @change="jumpDate">
               <a class=daynav v-bind:href=tomorrow>&#9654;</a><button type="submit">Submit</button></p>
         </p>    
+        <input type="hidden" name="merge" value="1">
+        <div class="conflicts" v-if="conflicts.length">
+            Not saved, as another sheet changed them first:
+            <ul><li v-for="c in conflicts" :key="c.species">
+                \{\{c.species\}\}: yours \{\{c.yours ? c.yours.count : 0\}\}, saved \{\{c.stored ? c.stored.count : 0\}\}
+            </li></ul>
+        </div>
         <table>
         <thead><tr><th>Species</th><th></th><th class="col_count">Count</th><th></th><th>Recent</th>
             <th v-for="oc in detail_options" :hidden="oc.hidden" >\{\{ oc.column_hdr \}\}</th></tr></thead>
@@ -322,6 +328,7 @@
        
         data: {
                 moths: [],
+                conflicts: {{!conflicts}},
                 this_date: "{{!dash_date_str}}",
                 detail_options: {
                     "Location": {name: "Location", list: {{!location_list}}, default: "{{!default_location}}", column_hdr: "Loc", hidden: true},
@@ -431,7 +438,7 @@
     // On load we want to combine the likely moths from the manifest and the recently seen moths.
     // This combination is not reactive so can be done once on load. 
 
-    manifest_moths = recent_moths;  // From manifest.js
+    manifest_moths = {{!manifest}};
     console.log("records: ", {{!records}})
     captured_moths = {{!records}};
     console.log("Captured Moths: ", captured_moths)
@@ -464,6 +471,7 @@
             all_moths[first_match].location = item.location;
             all_moths[first_match].recorder = item.recorder;
             all_moths[first_match].trap = item.trap;
+            all_moths[first_match].version = item.version;
 
         // else add to list
         } else {
@@ -0,0 +1,108 @@
+""" warmup.py
+
+A background worker that builds pages before anybody asks for them.
+
+After a restart, or once a survey has been submitted, the caches are cold and the
+first visitor to /summary, /species or a popular species page waited while it was
+built. moths_bottle now queues those pages here at startup and after each survey,
+and one worker thread builds them (filling the route and graph caches) so visitors
+almost always find them ready.
+
+Jobs are named. A job already waiting in the queue is not queued again, so a burst
+of surveys builds each page once. A job that is running when it is queued again is
+run again afterwards, as the data may have changed under it. The queue is bounded
+and jobs that don't fit are dropped, as a cold page is only slower, not wrong.
+
+Usage:
+    warmup.warmer.submit("summary", get_summary)
+    warmup.warmer.stats()   # shown in /status
+
+History
+-------
+18 Oct 2026 - Genesis
+"""
+import logging
+import queue
+import threading
+import time
+
+try:
+    from app_config_local import app_config as cfg
+except ModuleNotFoundError:
+    from app_config_default import app_config as cfg
+
+moth_logger = logging.getLogger("moth_logger")
+
+
+class Warmup:
+    """ A bounded queue of named jobs run one at a time by a daemon thread """
+
+    def __init__(self, maxsize=32):
+        self._queue = queue.Queue(maxsize)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._thread = None
+        self.running = None
+        self.done = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.last_job = None  # (name, seconds)
+
+    def submit(self, name, fn, *args, **kwargs):
+        """ Queue fn(*args, **kwargs) as job name unless it is already waiting.
+            Returns True if queued. """
+        with self._lock:
+            if name in self._pending:
+                self.deduplicated += 1
+                return False
+            try:
+                self._queue.put_nowait((name, fn, args, kwargs))
+            except queue.Full:
+                self.dropped += 1
+                moth_logger.debug(f"Warmup: queue full, dropped {name}")
+                return False
+            self._pending.add(name)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="warmup", daemon=True
+                )
+                self._thread.start()
+        return True
+
+    def _run(self):
+        while True:
+            name, fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self._pending.discard(name)
+                self.running = name
+            start = time.perf_counter()
+            try:
+                fn(*args, **kwargs)
+                self.done += 1
+            except Exception:
+                self.failed += 1
+                moth_logger.exception(f"Warmup: {name} failed")
+            self.last_job = (name, round(time.perf_counter() - start, 3))
+            with self._lock:
+                self.running = None
+            self._queue.task_done()
+
+    def join(self):
+        """ Wait until every queued job has run """
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": sorted(self._pending),
+                "running": self.running,
+                "done": self.done,
+                "failed": self.failed,
+                "deduplicated": self.deduplicated,
+                "dropped": self.dropped,
+                "last_job": self.last_job,
+            }
+
+
+warmer = Warmup(cfg.get("WARMUP_QUEUE", 32))